@@ -1,14 +1,21 @@
 import os
 import sys
+import time
 import json
 import logging
 import collections
 import math
+import bisect
+import contextlib
+import threading
+import functools
+import asyncio
 import scipy.stats
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import pandas as pd
 import numpy as np
 import alhena.constants as constants
-from alhena.elasticsearch import initialize_es, load_dashboard_record, load_records as _load_records, add_dashboard_to_projects
+from alhena.elasticsearch import initialize_es, load_dashboard_record, add_dashboard_to_projects, clear_index_cache, create_index, get_bulk_client, get_bulk_controller, get_index_name, get_next_index_version, get_current_index_version, swap_index_version, get_fingerprints, save_fingerprints, get_dashboard_bins_layout, delete_cells, fast_ingest as _fast_ingest, get_mapping, get_mapped_fields, DEFAULT_MAPPING, MAPPING_VERSION
 from scgenome.loaders.qc import load_qc_data
 import scgenome.loaders.align
 import scgenome.loaders.hmmcopy
@@ -16,6 +23,13 @@ import scgenome.loaders.annotation
 from scgenome.db.qc_from_files import get_qc_data_from_filenames
 import isabl_cli as ii
 from alhena.tantalus_colossus import get_colossus_tantalus_data, get_colossus_tantalus_analysis_object
+from alhena.isabl import get_isabl_analysis_object
+from alhena.checkpoint import Checkpoint
+from alhena.instrumentation import timed_stage, record_stage
+from alhena.export import BulkExport
+from alhena.bulk import encode_records
+from alhena.pipeline import Pipeline, PIPELINE_OPTIONS
+from alhena.async_elasticsearch import run_async, get_async_es, run_in_thread, iterate_in_thread, create_index_async, bulk_async, load_record_async, save_fingerprints_async, ASYNC_OPTIONS
 
 
 logger = logging.getLogger('alhena_loading')
@@ -26,8 +40,7 @@ chr_prefixed = {str(a): '0' + str(a) for a in range(1, 10)}
 
 
 
-def load_analysis_from_dirs(dashboard_id, projects, host, port, alignment_dir, hmmcopy_dir, annotation_dir):
-    
+def load_analysis_from_dirs(dashboard_id, projects, host, port, alignment_dir, hmmcopy_dir, annotation_dir, **load_kwargs):
     qc_data = scgenome.loaders.align.load_align_data(alignment_dir)
 
     for table_name, data in scgenome.loaders.hmmcopy.load_hmmcopy_data(hmmcopy_dir).items():
@@ -36,27 +49,100 @@ def load_analysis_from_dirs(dashboard_id, projects, host, port, alignment_dir, h
     for table_name, data in scgenome.loaders.annotation.load_annotation_data(annotation_dir).items():
         qc_data[table_name] = data
 
-    load_data(dashboard_id, host, port, qc_data)
-    
-    analysis_record = get_isabl_analysis_object(dashboard_id)
-    load_dashboard_entry(analysis_record,dashboard_id, host, port )
-    add_dashboard_to_projects(dashboard_id, projects, host, port)
+    load_libraries(dashboard_id, [("", qc_data)], get_isabl_analysis_object(dashboard_id),
+                   projects, host, port, **load_kwargs)
 
-    logger.info("Done")
 
-def load_analysis(dashboard_id,data,analysis_record, projects, directory, host, port):
+def load_analysis(dashboard_id,data,analysis_record, projects, directory, host, port, **load_kwargs):
     logger.info("====================== " + dashboard_id)
-    load_data(dashboard_id, host, port,data)
-    load_dashboard_entry(analysis_record,dashboard_id, host, port )
-    add_dashboard_to_projects(dashboard_id, projects, host, port)
+    load_libraries(dashboard_id, [("", data)], analysis_record,
+                   projects, host, port, **load_kwargs)
+
+
+def load_merged_analysis(dashboard_id, projects, directory, host, port, parse_workers=1, parse_memory=None, **load_kwargs):
+    metadata_dir, libraries = get_merged_libraries(dashboard_id, directory)
+
+    add_columns = get_fitness_columns(
+        directory) if "Fitness" in projects else None
+
+    analysis_record = get_colossus_tantalus_analysis_object(metadata_dir, dashboard_id,merged= True)
+
+    # parsed as they are loaded
+    parsed_libraries = parse_libraries(
+        directory, libraries, workers=parse_workers, max_memory=parse_memory)
+    load_libraries(dashboard_id, parsed_libraries, analysis_record, projects, host, port,
+                   add_columns=add_columns, **load_kwargs)
+
+    if add_columns is not None:
+        add_columns.report()
+
+
+def load_libraries(dashboard_id, libraries, analysis_record, projects, host, port, fast_ingest=False, force_merge=False, resume=False, delta=False, bins_layout=constants.BINS_LAYOUT_BIN, roles=None, engine=constants.ENGINE_SYNC, **load_kwargs):
+    """Load libraries, an iterable of (source, hmmcopy data), then switch the dashboard's aliases and add its record to projects
+
+    The checkpoint is only removed once every step has finished, so a load
+    that fails part way can be continued with --resume
+    """
+    checkpoint = start_load(dashboard_id, host, port, resume=resume, delta=delta, bins_layout=bins_layout)
+
+    with ingest_settings(dashboard_id, checkpoint.version, host, port, fast_ingest=fast_ingest, force_merge=force_merge, bins_layout=bins_layout, delta=delta):
+        for source, hmmcopy_data in libraries:
+            if source:
+                logger.info(f"Indexing library {source}")
+            load_data(dashboard_id, host, port, hmmcopy_data, checkpoint=checkpoint, source=source,
+                      version=checkpoint.version, delta=delta, bins_layout=bins_layout, engine=engine, **load_kwargs)
+            # released before the next library is parsed
+            del hmmcopy_data
+    swap_index_version(dashboard_id, checkpoint.version, host, port)
+
+    finish_dashboard(analysis_record, dashboard_id, projects, host, port,
+                     bins_layout=bins_layout, roles=roles, engine=engine)
+    checkpoint.finish()
+
     logger.info("Done")
 
 
+def export_analysis(dashboard_id, data, analysis_record, projects, output, bins_layout=constants.BINS_LAYOUT_BIN, **load_kwargs):
+    """Write the dashboard's bulk requests to files in output, to be loaded later with replay_bulk"""
+    logger.info("====================== " + dashboard_id)
+    export = BulkExport(output, dashboard_id)
+    load_data(dashboard_id, None, None, data,
+              export=export, bins_layout=bins_layout, **load_kwargs)
+    export.write_dashboard_entry(
+        get_dashboard_entry(analysis_record, bins_layout=bins_layout))
+    export.finish(projects)
+
+
+def export_merged_analysis(dashboard_id, projects, directory, output, parse_workers=1, parse_memory=None, bins_layout=constants.BINS_LAYOUT_BIN, **load_kwargs):
+    logger.info("====================== " + dashboard_id)
+    metadata_dir, libraries = get_merged_libraries(dashboard_id, directory)
+
+    add_columns = get_fitness_columns(
+        directory) if "Fitness" in projects else None
+
+    export = BulkExport(output, dashboard_id)
+    parsed_libraries = parse_libraries(
+        directory, libraries, workers=parse_workers, max_memory=parse_memory)
+
+    for library_idx, (library, hmmcopy_data) in enumerate(parsed_libraries):
+        logger.info(
+            f"Exporting library {library} ({library_idx + 1} / {len(libraries)})")
+        load_data(dashboard_id, None, None, hmmcopy_data, add_columns=add_columns,
+                  source=library, export=export, bins_layout=bins_layout, **load_kwargs)
+        del hmmcopy_data
 
+    if add_columns is not None:
+        add_columns.report()
 
+    analysis_record = get_colossus_tantalus_analysis_object(
+        metadata_dir, dashboard_id, merged=True)
+    export.write_dashboard_entry(
+        get_dashboard_entry(analysis_record, bins_layout=bins_layout))
+    export.finish(projects)
 
-def load_merged_analysis(dashboard_id, projects, directory, host, port):
 
+def get_merged_libraries(dashboard_id, directory):
+    """Path of a merged dashboard's metadata file, and the libraries it lists"""
     metadata_dir = os.path.join(
         directory, constants.MERGED_DIRECTORYNAME, f'{dashboard_id}.json')
 
@@ -65,76 +151,307 @@ def load_merged_analysis(dashboard_id, projects, directory, host, port):
 
     with open(metadata_dir) as metadata_file:
         metadata = json.load(metadata_file)
-        libraries = metadata["libraries"]
 
-    add_columns = get_fitness_columns(
-        directory) if "Fitness" in projects else []
+    return metadata_dir, metadata["libraries"]
 
-    for library in libraries:
-        library_directory = os.path.join(directory, library)
-        hmmcopy_data = get_colossus_tantalus_data(library_directory)
-        load_data(dashboard_id,
-                  host, port, hmmcopy_data, add_columns=add_columns)
 
-    analysis_record = get_colossus_tantalus_analysis_object(metadata_dir, dashboard_id,merged= True)
+def parse_libraries(directory, libraries, workers=1, max_memory=None):
+    """Yield (library, hmmcopy data) for each library, parsing up to workers libraries in parallel processes
+
+    The number of parsed libraries held in memory at once (including the one
+    being indexed) is limited so their estimated size stays within max_memory
+    bytes, by default half of the memory available
+    """
+    if workers <= 1:
+        for library in libraries:
+            yield library, get_colossus_tantalus_data(os.path.join(directory, library))
+        return
 
-    load_dashboard_entry(analysis_record, dashboard_id,
-                     host, port)
+    if max_memory is None:
+        max_memory = get_available_memory() // 2
 
-    add_dashboard_to_projects(dashboard_id, projects, host, port)
+    pending = list(libraries)
+    max_resident = workers
+    num_parsed = 0
 
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        inflight = {}
+        while len(pending) > 0 or len(inflight) > 0:
+            # the library being indexed is released before this resumes, and
+            # while it is indexed the libraries in flight take the other slots
+            while len(pending) > 0 and len(inflight) < max_resident:
+                library = pending.pop(0)
+                future = executor.submit(
+                    get_colossus_tantalus_data, os.path.join(directory, library))
+                inflight[future] = (library, time.perf_counter())
 
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for future in done:
+                library, submitted = inflight.pop(future)
+                hmmcopy_data = future.result()
+                num_parsed += 1
 
-def load_data( dashboard_id, host, port, data, add_columns=[]):
+                # metrics recorded in the worker processes are lost with them
+                record_stage("parse", os.path.join(directory, library), time.perf_counter() - submitted,
+                             rows=sum(table.shape[0] for table in hmmcopy_data.values()))
+
+                library_bytes = sum(table.memory_usage(deep=True).sum()
+                                    for table in hmmcopy_data.values())
+                max_resident = max(
+                    1, min(workers, int(max_memory // max(library_bytes, 1))))
+                logger.info(
+                    f"Parsed library {library} ({num_parsed} / {len(libraries)}), {library_bytes / 1024 ** 2:.0f} MB, keeping up to {max_resident} in memory")
+
+                yield library, hmmcopy_data
+
+                # the consumer has finished with it, so it no longer takes a
+                # slot while the next libraries are parsed
+                del hmmcopy_data
+
+
+def get_available_memory():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return 8 * 1024 ** 3
+
+
+def start_load(dashboard_id, host, port, resume=False, delta=False, bins_layout=constants.BINS_LAYOUT_BIN):
+    """Set up the checkpoint of a dashboard load, with the index version to load into
+
+    Delta loads update the version currently in use instead of creating a new one
+    """
+    clear_index_cache()
+
+    if delta:
+        # fingerprints are of the bins before packing, so a layout change would find no changed cells
+        current_bins_layout = get_dashboard_bins_layout(dashboard_id, host, port)
+        assert current_bins_layout is None or current_bins_layout == bins_layout, f'{dashboard_id} is loaded with the {current_bins_layout} bins layout, changing it to {bins_layout} needs --reload without --delta'
+    checkpoint = Checkpoint(dashboard_id, resume=resume)
+
+    if delta and checkpoint.version is None:
+        current_version = get_current_index_version(dashboard_id, host, port)
+        if current_version is None:
+            logger.info(f"No previous load of {dashboard_id}, loading all cells")
+        else:
+            checkpoint.set_version(current_version)
+
+    if checkpoint.version is None:
+        checkpoint.set_version(
+            get_next_index_version(dashboard_id, host, port))
+    logger.info(f"Loading {dashboard_id} into version {checkpoint.version}")
+
+    return checkpoint
+
+
+def ingest_settings(dashboard_id, version, host, port, fast_ingest=False, force_merge=False, bins_layout=constants.BINS_LAYOUT_BIN, delta=False):
+    if not fast_ingest:
+        return contextlib.nullcontext()
+
+    # a delta load writes into the version being served, which keeps its replicas and refreshes
+    if delta and get_current_index_version(dashboard_id, host, port) == version:
+        logger.info(
+            f"Not applying --fast-ingest to {dashboard_id}, version {version} is live")
+        return contextlib.nullcontext()
+
+    indices = {get_index_name(dashboard_id, index_type, version): get_mapping(index_type, bins_layout)
+               for index_type in constants.DATA_TYPES}
+
+    return _fast_ingest(indices, host, port, force_merge=force_merge)
+
+
+def load_data( dashboard_id, host, port, data, add_columns=None, concurrent=False, checkpoint=None, source="", version=None, delta=False, bins_layout=constants.BINS_LAYOUT_BIN, export=None, engine=constants.ENGINE_SYNC):
     logger.info("LOADING DATA: " + dashboard_id)
 
     hmmcopy_data = data
 
     logger.info(f'loading hmmcopy data with tables {hmmcopy_data.keys()}')
-    print(hmmcopy_data)
-    for index_type in constants.DATA_TYPES:
-        index_name = f"{dashboard_id.lower()}_{index_type}"
-        logger.info(f"Index {index_name}")
+    logger.debug(
+        f'table shapes {({name: table.shape for name, table in hmmcopy_data.items()})}')
+
+    # the async engine always loads index types at the same time
+    if engine == constants.ENGINE_ASYNC and export is None:
+        run_async(load_data_async(dashboard_id, host, port, hmmcopy_data, add_columns=add_columns,
+                                    checkpoint=checkpoint, source=source, version=version, delta=delta, bins_layout=bins_layout))
+        return
+
+    if not concurrent:
+        for index_type in constants.DATA_TYPES:
+            load_index(dashboard_id, index_type, hmmcopy_data,
+                       host, port, add_columns=add_columns, checkpoint=checkpoint, source=source, version=version, delta=delta, bins_layout=bins_layout, export=export)
+        return
+
+    # index types are independent, so the small ones do not wait behind bins;
+    # the number of bulk requests in flight is capped in alhena.elasticsearch
+    with ThreadPoolExecutor(max_workers=len(constants.DATA_TYPES)) as executor:
+        futures = {executor.submit(load_index, dashboard_id, index_type, hmmcopy_data, host, port, add_columns=add_columns, checkpoint=checkpoint, source=source, version=version, delta=delta, bins_layout=bins_layout, export=export): index_type
+                   for index_type in constants.DATA_TYPES}
+
+        for future in as_completed(futures):
+            future.result()
+            logger.info(f"Finished {futures[future]} for {dashboard_id}")
+
+
+def load_index(dashboard_id, index_type, hmmcopy_data, host, port, add_columns=None, checkpoint=None, source="", version=None, delta=False, bins_layout=constants.BINS_LAYOUT_BIN, export=None):
+    """Load one index type, or write its bulk requests to export without touching the cluster"""
+    index_name, data, id_fields, mapping, fingerprints = prepare_index(
+        dashboard_id, index_type, hmmcopy_data, host, port, add_columns=add_columns, checkpoint=checkpoint, source=source, version=version, delta=delta, bins_layout=bins_layout, export=export)
+
+    if export is not None:
+        export.add_index(index_name, mapping)
+        with timed_stage("export", index_name) as stage:
+            load_records(data, index_name, host, port, mapping=mapping,
+                         id_fields=id_fields, source=source, export=export)
+            stage["rows"] = data.shape[0]
+        return
+
+    with timed_stage("load", index_name) as stage:
+        load_records(data, index_name, host, port, mapping=mapping,
+                     id_fields=id_fields, checkpoint=checkpoint, source=source)
+        stage["rows"] = data.shape[0]
+
+    # load_records raises if any document failed, so the cells of a failed
+    # batch keep their previous fingerprints and a later --delta sends them again
+    save_fingerprints(dashboard_id, index_name, source,
+                      fingerprints, host, port)
+
+
+def prepare_index(dashboard_id, index_type, hmmcopy_data, host, port, add_columns=None, checkpoint=None, source="", version=None, delta=False, bins_layout=constants.BINS_LAYOUT_BIN, export=None):
+    """Transform the data of one index type, returning (index name, data, id fields, mapping, fingerprints)"""
+    index_name = get_index_name(dashboard_id, index_type, version)
+    logger.info(f"Index {index_name}")
+
+    with timed_stage("transform", index_name) as stage:
+        data = GET_DATA[index_type](hmmcopy_data)
 
-        data = eval(f"get_{index_type}_data(hmmcopy_data)")
-        
         #fitness case handler, was commented out for MSK igo, bccrc load
-        
-        if index_type == "qc" and len(add_columns) > 0:
 
-            old_cell_count = data.shape[0]
+        if index_type == "qc" and add_columns is not None:
+            # cells missing from the fitness columns are counted, not loaded
             data = process_qc_fitness_data(data, add_columns)
-           
-            #this assertion will be wrong for a while :(, commented out
-            #assert data.shape[0] == old_cell_count, "Missing cells after merge with new columns"
-    
-        load_records(data, index_name, host, port)
-
-def process_qc_fitness_data(data,add_columns):
-
-    column_df = pd.DataFrame(add_columns)
-    #create temp_cell_id, merge on it, delete it
-    column_df["temp_cell_id"] = column_df["cell_id"].astype(str)
-    column_df["temp_cell_id"] = column_df["cell_id"].str.split(
-        "-", 1).str[1]
-    data["temp_cell_id"] = data["cell_id"].astype(str)
-    data["temp_cell_id"] = data["cell_id"].str.split(
-        "-", 1).str[1]
-    #make room for new ordering
-    data.drop('order', axis=1, inplace=True)
-    #merge
-    data = pd.merge(data, column_df, how="inner", on="temp_cell_id")
-    del data["cell_id_x"]
-    del data["temp_cell_id"]
-    data = data.rename(columns={'cell_id_y': "cell_id"})
 
-    return data
+        # exports are not compared against a cluster, so have no fingerprints
+        fingerprints = get_cell_fingerprints(data) if export is None else None
+
+        if delta:
+            data = get_changed_cells_data(
+                data, index_name, source, fingerprints, host, port, checkpoint=checkpoint)
+
+        # fingerprints are of the bins, whichever layout they are indexed in
+        id_fields = DOCUMENT_ID_FIELDS[index_type]
+        if index_type == "bins" and bins_layout == constants.BINS_LAYOUT_PACKED:
+            data = get_packed_bins_data(data)
+            id_fields = PACKED_BINS_ID_FIELDS
+        stage["rows"] = data.shape[0]
+
+    return index_name, data, id_fields, get_mapping(index_type, bins_layout), fingerprints
+
+
+async def load_data_async(dashboard_id, host, port, hmmcopy_data, add_columns=None, checkpoint=None, source="", version=None, delta=False, bins_layout=constants.BINS_LAYOUT_BIN):
+    """Load every index type on one event loop, overlapping their index creation, bulk requests and fingerprint writes"""
+    es = get_async_es(host, port)
+    await asyncio.gather(*[load_index_async(es, dashboard_id, index_type, hmmcopy_data, host, port, add_columns=add_columns, checkpoint=checkpoint, source=source, version=version, delta=delta, bins_layout=bins_layout)
+                           for index_type in constants.DATA_TYPES])
+
+
+async def load_index_async(es, dashboard_id, index_type, hmmcopy_data, host, port, add_columns=None, checkpoint=None, source="", version=None, delta=False, bins_layout=constants.BINS_LAYOUT_BIN):
+    # transforms (and delta comparisons, on the sync client) run on worker threads
+    index_name, data, id_fields, mapping, fingerprints = await run_in_thread(
+        prepare_index, dashboard_id, index_type, hmmcopy_data, host, port, add_columns=add_columns, checkpoint=checkpoint, source=source, version=version, delta=delta, bins_layout=bins_layout)
+
+    await create_index_async(es, index_name, mapping=mapping)
+    with timed_stage("load", index_name) as stage:
+        await load_records_async(es, data, index_name, mapping=mapping,
+                                 id_fields=id_fields, checkpoint=checkpoint, source=source)
+        stage["rows"] = data.shape[0]
+
+    # only reached when every document was indexed, as in load_index
+    await save_fingerprints_async(es, dashboard_id, index_name, source, fingerprints)
+    logger.info(f"Finished {index_type} for {dashboard_id}")
+
+
+def get_cell_fingerprints(data):
+    """Hash of each cell's rows, as {cell_id: hex digest}"""
+    if data.shape[0] == 0:
+        return {}
+
+    row_hashes = pd.Series(pd.util.hash_pandas_object(
+        data, index=False).values, dtype=np.uint64)
+    cell_ids = np.asarray(data["cell_id"], dtype=object)
+
+    # the sum (wrapping at 2^64) does not depend on row order
+    cell_hashes = row_hashes.groupby(cell_ids).agg(['sum', 'count'])
+
+    return {str(cell_id): f"{int(row['sum']):016x}-{int(row['count'])}"
+            for cell_id, row in cell_hashes.iterrows()}
+
+
+def get_changed_cells_data(data, index_name, source, fingerprints, host, port, checkpoint=None):
+    """Rows of cells that changed since the last load, after deleting the documents of changed and removed cells
+
+    The previous fingerprints are only replaced once the index is loaded, so a
+    resumed load finds the same cells again. The deletion is recorded in the
+    checkpoint and not repeated, as it would remove documents of batches that
+    were already sent and will be skipped
+    """
+    previous_fingerprints = get_fingerprints(index_name, source, host, port)
+
+    if previous_fingerprints is None:
+        logger.info(f"{index_name}: no fingerprints from a previous load, loading all cells")
+        return data
+
+    changed_cells = [cell_id for cell_id, fingerprint in fingerprints.items()
+                     if previous_fingerprints.get(cell_id) != fingerprint]
+    removed_cells = [cell_id for cell_id in previous_fingerprints
+                     if cell_id not in fingerprints]
+
+    logger.info(
+        f"{index_name}: {len(changed_cells)} changed and {len(removed_cells)} removed of {len(fingerprints)} cells")
+
+    # rows of a changed cell may have gone, so its documents are replaced
+    stale_cells = [cell_id for cell_id in changed_cells if cell_id in previous_fingerprints]
+    delete_key = f'delete:{index_name}:{source}'
+    if checkpoint is not None and checkpoint.is_done(delete_key):
+        logger.info(f"{index_name}: documents of changed cells already deleted")
+    else:
+        delete_cells(index_name, stale_cells + removed_cells, host, port)
+        if checkpoint is not None:
+            checkpoint.mark_done(delete_key, len(stale_cells + removed_cells))
+
+    return data[np.isin(np.asarray(data["cell_id"], dtype=object).astype(str), changed_cells)]
+
+def process_qc_fitness_data(data, add_columns):
+    """Join the fitness columns onto QC data, dropping and counting cells without a match"""
+    positions = add_columns.table.index.get_indexer(
+        get_cell_keys(data["cell_id"]))
+    matched = positions >= 0
+
+    add_columns.count(data["cell_id"], matched)
+
+    #fitness order and cell_id replace the ones from qc
+    data = data.loc[matched].drop(columns=["cell_id", "order"], errors="ignore")
+    fitness = add_columns.table.iloc[positions[matched]]
+    for column in fitness.columns:
+        data[column] = fitness[column].values
+
+    return data.reset_index(drop=True)
+
+
+def get_cell_keys(cell_ids):
+    """Cell IDs without their sample prefix, the part after the first '-'"""
+    # only the distinct IDs are split, then broadcast back by category code
+    cell_ids = pd.Categorical(cell_ids)
+    keys = pd.Series(cell_ids.categories.astype(str)).str.partition('-')[2]
+    return np.asarray(keys, dtype=object)[cell_ids.codes]
 
 def get_qc_data(hmmcopy_data):
     data = hmmcopy_data['annotation_metrics']
-    data['percent_unmapped_reads'] = data["unmapped_reads"] / data["total_reads"]
-    data['is_contaminated'] = data['is_contaminated'].apply(
-        lambda a: {True: 'true', False: 'false'}[a])
+    data['percent_unmapped_reads'] = data["unmapped_reads"].values / \
+        data["total_reads"].values
+    is_contaminated = data['is_contaminated'].map({True: 'true', False: 'false'})
+    assert is_contaminated.notna().all(
+    ), f'is_contaminated has values other than True and False: {data["is_contaminated"][is_contaminated.isna()].unique().tolist()}'
+    data['is_contaminated'] = is_contaminated
     return data
 
 
@@ -150,22 +467,138 @@ def get_bins_data(hmmcopy_data):
     return data
 
 
+def get_packed_bins_data(bins_data):
+    """Bins packed into one row per cell and chromosome, with an array of each of the PACKED_BINS_FIELDS in start order"""
+    scalar_columns = [column for column in ['cell_id', 'sample_id', 'library_id', 'chr', 'chrom_number']
+                      if column in bins_data.columns]
+    if bins_data.shape[0] == 0:
+        return pd.DataFrame(columns=scalar_columns + ['num_bins'] + constants.PACKED_BINS_FIELDS)
+
+    data = bins_data.sort_values(['cell_id', 'chr', 'start'], kind='mergesort')
+
+    cell_codes = pd.factorize(data['cell_id'])[0]
+    chr_codes = pd.factorize(data['chr'])[0]
+    boundaries = np.flatnonzero(
+        (np.diff(cell_codes) != 0) | (np.diff(chr_codes) != 0)) + 1
+    group_starts = np.concatenate([[0], boundaries])
+
+    packed = data[scalar_columns].iloc[group_starts].reset_index(drop=True)
+    packed['num_bins'] = np.diff(np.append(group_starts, data.shape[0]))
+
+    for field in constants.PACKED_BINS_FIELDS:
+        # slices of a contiguous column, which the serializer writes out directly
+        arrays = np.empty(len(group_starts), dtype=object)
+        for group_idx, values in enumerate(np.split(np.ascontiguousarray(data[field].values), boundaries)):
+            arrays[group_idx] = values
+        packed[field] = arrays
+
+    return packed
+
+
 def get_gc_bias_data(hmmcopy_data):
     data = hmmcopy_data['gc_metrics']
 
-    gc_cols = list(range(101))
-    gc_bias_df = pd.DataFrame(columns=['cell_id', 'gc_percent', 'value'])
-    for n in gc_cols:
-        new_df = data.loc[:, ['cell_id', str(n)]]
-        new_df.columns = ['cell_id', 'value']
-        new_df['gc_percent'] = n
-        gc_bias_df = gc_bias_df.append(new_df, ignore_index=True)
+    # wide (one column per gc percent) to long, gc percent major as before
+    gc_cols = [str(n) for n in range(101)]
+    values = data[gc_cols].values
+    num_cells = values.shape[0]
+
+    gc_bias_df = pd.DataFrame({
+        'cell_id': np.tile(data['cell_id'].values, len(gc_cols)),
+        'gc_percent': np.repeat(np.arange(len(gc_cols)), num_cells),
+        'value': values.T.ravel()
+    }, columns=['cell_id', 'gc_percent', 'value'])
 
     return gc_bias_df
 
 
+def get_bin_level_data(hmmcopy_data, bin_size):
+    """Bins aggregated per cell into bin_size bp bins, or into chromosome arms if bin_size is None"""
+    data = hmmcopy_data['hmmcopy_reads']
+
+    chromosomes = data['chr'].astype('category')
+    starts = data['start'].values
+
+    if bin_size is None:
+        centromeres = chromosomes.cat.categories.map(
+            lambda a: constants.CENTROMERE_STARTS.get(str(a), np.inf))
+        centromere_starts = np.asarray(centromeres, dtype=float)[
+            chromosomes.cat.codes.values]
+        level_bin = (starts >= centromere_starts).astype(np.int8)
+    else:
+        level_bin = (starts - 1) // bin_size
+
+    grouped = pd.DataFrame({
+        'cell_id': data['cell_id'].values,
+        'chr': chromosomes.values,
+        'level_bin': level_bin,
+        'start': starts,
+        'end': data['end'].values,
+        'copy': data['copy'].values,
+        'state': data['state'].values,
+        'reads': data['reads'].values
+    }).groupby(['cell_id', 'chr', 'level_bin'], observed=True, sort=False)
+
+    level_data = grouped.agg({
+        'start': 'min',
+        'end': 'max',
+        'copy': 'mean',
+        'state': 'median',
+        'reads': 'sum'
+    })
+    level_data['num_bins'] = grouped.size()
+    level_data = level_data.reset_index()
+
+    level_data['state'] = level_data['state'].round()
+    level_data['chrom_number'] = create_chrom_number(level_data['chr'])
+    if bin_size is None:
+        level_data['arm'] = np.where(level_data['level_bin'] == 0, 'p', 'q')
+
+    return level_data.drop(columns=['level_bin'])
+
+
+def get_cell_summary_data(hmmcopy_data):
+    """One row per cell with its ploidy, state fractions, mean copy per chromosome and segment count"""
+    bins = hmmcopy_data['hmmcopy_reads']
+    segs = hmmcopy_data['hmmcopy_segs']
+
+    cell_ids = np.asarray(bins['cell_id'], dtype=object)
+    states = bins['state'].values
+    copy = bins['copy'].values
+
+    by_cell = pd.DataFrame({'state': states, 'copy': copy}).groupby(cell_ids)
+    summary = pd.DataFrame({
+        'ploidy': by_cell['state'].mean(),
+        'mean_copy': by_cell['copy'].mean(),
+        'num_bins': by_cell.size()
+    })
+
+    state_counts = pd.crosstab(cell_ids, states)
+    state_fractions = state_counts.div(state_counts.sum(axis=1), axis=0)
+    state_fractions.columns = [
+        f'state_fraction_{int(state)}' for state in state_fractions.columns]
+
+    chrom_numbers = np.asarray(create_chrom_number(bins['chr']), dtype=object)
+    chrom_copy = pd.DataFrame({'copy': copy}).groupby(
+        [cell_ids, chrom_numbers])['copy'].mean().unstack()
+    chrom_copy.columns = [
+        f'mean_copy_chr_{chrom_number}' for chrom_number in chrom_copy.columns]
+
+    num_segments = pd.Series(np.asarray(segs['cell_id'], dtype=object)).value_counts()
+
+    summary = summary.join(state_fractions).join(chrom_copy)
+    summary['num_segments'] = num_segments.reindex(
+        summary.index).fillna(0).astype(int).values
+
+    summary.index.name = 'cell_id'
+    return summary.reset_index()
+
+
 def create_chrom_number(chromosomes):
-    chrom_number = chromosomes.map(lambda a: chr_prefixed.get(a, a))
+    # only map the distinct chromosome names, then broadcast back
+    chromosomes = chromosomes.astype('category')
+    chrom_number = chromosomes.cat.rename_categories(
+        [chr_prefixed.get(str(a), str(a)) for a in chromosomes.cat.categories])
     return chrom_number
 
 
@@ -174,62 +607,316 @@ GET_DATA = {
     f"segs": get_segs_data,
     f"bins": get_bins_data,
     f"gc_bias": get_gc_bias_data,
+    **{level: functools.partial(get_bin_level_data, bin_size=bin_size)
+       for level, bin_size in constants.BIN_LEVELS.items()},
+    constants.CELL_SUMMARY_TYPE: get_cell_summary_data
 }
 
+# fields that identify a document, joined to make its _id
+DOCUMENT_ID_FIELDS = {
+    "qc": ["cell_id"],
+    "segs": ["cell_id", "chr", "start"],
+    "bins": ["cell_id", "chr", "start"],
+    "gc_bias": ["cell_id", "gc_percent"],
+    **{level: ["cell_id", "chr", "start"] for level in constants.BIN_LEVELS},
+    constants.CELL_SUMMARY_TYPE: ["cell_id"]
+}
 
-def load_records(data, index_name, host, port):
+PACKED_BINS_ID_FIELDS = ["cell_id", "chr"]
+
+# rows per batch of records, the unit of checkpointing
+RECORD_BATCH_SIZE = int(1e5)
 
-    total_records = data.shape[0]
-    num_records = 0
 
-    batch_size = int(1e5)
-    for batch_start_idx in range(0, data.shape[0], batch_size):
-        batch_end_idx = min(batch_start_idx + batch_size, data.shape[0])
-        batch_data = data.loc[data.index[batch_start_idx:batch_end_idx]]
+def load_records(data, index_name, host, port, mapping=DEFAULT_MAPPING, id_fields=[], checkpoint=None, source="", export=None):
+    """Send the rows of data as records to index_name, or write them to export
 
-        clean_fields(batch_data)
+    Loading runs as a pipeline: slices of rows are turned into records, then
+    serialized, each stage on its own workers (PIPELINE_OPTIONS) with bounded
+    queues between them. The serialized lines are streamed to the bulk
+    controller, which sizes and sends the requests, so building records
+    overlaps sending
+    """
+    total_records = data.shape[0]
+    num_records = 0
 
-        records = []
-        for record in batch_data.to_dict(orient='records'):
-            clean_nans(record)
-            records.append(record)
+    fields, id_columns = get_record_fields(data, index_name, mapping, id_fields)
+
+    if export is not None:
+        # part files are written in order, from this thread
+        for batch_start_idx in range(0, total_records, RECORD_BATCH_SIZE):
+            batch_end_idx = min(batch_start_idx + RECORD_BATCH_SIZE, total_records)
+            export.write(generate_records(data, fields, batch_start_idx, batch_end_idx, id_columns=id_columns),
+                         index_name, source=source)
+        return
+
+    # created even when there is no data, so the alias can point at it
+    create_index(index_name, host, port, mapping=mapping)
+    es = get_bulk_client(host, port)
+    controller = get_bulk_controller(host, port)
+
+    # remaining slices and failed documents of each batch in flight
+    batches = {}
+    lock = threading.Lock()
+
+    def get_slices():
+        nonlocal num_records
+        slice_rows = PIPELINE_OPTIONS["slice_rows"]
+
+        for batch_start_idx in range(0, total_records, RECORD_BATCH_SIZE):
+            batch_end_idx = min(batch_start_idx + RECORD_BATCH_SIZE, total_records)
+
+            batch_key = Checkpoint.batch_key(
+                index_name, source, batch_start_idx, batch_end_idx, total_records)
+            if checkpoint is not None and checkpoint.is_done(batch_key):
+                logger.info(
+                    f"{index_name}: Skipping completed records {batch_start_idx} to {batch_end_idx}")
+                with lock:
+                    num_records += batch_end_idx - batch_start_idx
+                continue
+
+            slice_starts = range(batch_start_idx, batch_end_idx, slice_rows)
+            with lock:
+                batches[batch_key] = {"slices": len(slice_starts), "failed": 0,
+                                      "records": batch_end_idx - batch_start_idx}
+            for slice_start_idx in slice_starts:
+                yield batch_key, slice_start_idx, min(slice_start_idx + slice_rows, batch_end_idx)
+
+    def build(item):
+        batch_key, start_idx, end_idx = item
+        return batch_key, list(generate_records(data, fields, start_idx, end_idx, id_columns=id_columns))
+
+    def serialize(item):
+        batch_key, records = item
+        return batch_key, list(encode_records(records, index_name))
+
+    # slices in the order their lines are sent, as [first line, end line, batch key, lines not yet sent]
+    sent_slices = []
+    sent_slice_starts = []
+
+    def finish_slice(sent_slice):
+        nonlocal num_records
+        batch_key = sent_slice[2]
+        with lock:
+            batch = batches[batch_key]
+            batch["slices"] -= 1
+            if batch["slices"] > 0:
+                return
+            num_records += batch["records"]
+            progress = num_records
 
-        _load_records(records, index_name, host, port)
-        num_records += batch_data.shape[0]
         logger.info(
-            f"Loading {len(records)} records. Total: {num_records} / {total_records} ({round(num_records * 100 / total_records, 2)}%)")
+            f"{index_name}: Loading {batch['records']} records. Total: {progress} / {total_records} ({round(progress * 100 / total_records, 2)}%)")
+
+        # a batch with failed documents is left to be sent again on resume
+        if checkpoint is not None and batch["failed"] == 0:
+            checkpoint.mark_done(batch_key, batch["records"])
+
+    def stream_lines(items):
+        position = 0
+        for batch_key, lines in items:
+            sent_slice = [position, position + len(lines), batch_key, len(lines)]
+            position += len(lines)
+            if len(lines) == 0:
+                finish_slice(sent_slice)
+                continue
+
+            sent_slices.append(sent_slice)
+            sent_slice_starts.append(sent_slice[0])
+            yield from lines
+
+    num_failed_documents = 0
+
+    def on_done(start, count, num_success, num_failed):
+        nonlocal num_failed_documents
+        num_failed_documents += num_failed
+        # a request can span several slices, a failure in it fails all of their batches
+        idx = bisect.bisect_right(sent_slice_starts, start) - 1
+        while idx < len(sent_slices) and sent_slices[idx][0] < start + count:
+            sent_slice = sent_slices[idx]
+            idx += 1
+            if num_failed > 0:
+                with lock:
+                    batches[sent_slice[2]]["failed"] += num_failed
+            sent_slice[3] -= min(sent_slice[1], start + count) - max(sent_slice[0], start)
+            if sent_slice[3] == 0:
+                finish_slice(sent_slice)
+
+    def send(items):
+        # one stream of lines for the controller, so requests are sized by its
+        # chunk_bytes and sent on its threads
+        controller.bulk_lines(es, stream_lines(items), index_name, on_done=on_done)
+
+    Pipeline(index_name, [
+        ("build", build, PIPELINE_OPTIONS["build_workers"]),
+        ("serialize", serialize, PIPELINE_OPTIONS["serialize_workers"])
+    ], sink=("send", send)).run(get_slices())
+
+    # the failed batches are left out of the checkpoint, which is kept for --resume
+    # as the load stops before the aliases are switched
+    assert num_failed_documents == 0, f'{index_name}: {num_failed_documents} documents failed, run again with --resume to retry their batches'
 
     if total_records != num_records:
         raise ValueError(
-            f'mismatch in {num_cells} cells loaded to {total_cells} total cells')
+            f'mismatch in {num_records} records loaded to {total_records} total records')
 
 
-def clean_fields(data):
+async def load_records_async(es, data, index_name, mapping=DEFAULT_MAPPING, id_fields=[], checkpoint=None, source=""):
+    """load_records on the async client, sending ASYNC_OPTIONS["streams_per_index"] batches at a time"""
+    total_records = data.shape[0]
+    fields, id_columns = get_record_fields(data, index_name, mapping, id_fields)
+    streams = asyncio.Semaphore(ASYNC_OPTIONS["streams_per_index"])
+    num_loaded = 0
+    num_failed_documents = 0
+
+    async def load_batch(batch_start_idx, batch_end_idx):
+        nonlocal num_loaded, num_failed_documents
+        batch_key = Checkpoint.batch_key(
+            index_name, source, batch_start_idx, batch_end_idx, total_records)
+        if checkpoint is not None and checkpoint.is_done(batch_key):
+            logger.info(
+                f"{index_name}: Skipping completed records {batch_start_idx} to {batch_end_idx}")
+            return
+
+        async with streams:
+            # records are built on worker threads while requests are in flight
+            records = iterate_in_thread(generate_records(
+                data, fields, batch_start_idx, batch_end_idx, id_columns=id_columns))
+            num_success, num_failed = await bulk_async(es, records, index_name)
+
+        num_loaded += batch_end_idx - batch_start_idx
+        num_failed_documents += num_failed
+        logger.info(
+            f"{index_name}: Loading {batch_end_idx - batch_start_idx} records. Total: {num_loaded} / {total_records} ({round(num_loaded * 100 / total_records, 2)}%)")
+
+        # a batch with failed documents is left to be sent again on resume
+        if checkpoint is not None and num_failed == 0:
+            checkpoint.mark_done(batch_key, batch_end_idx - batch_start_idx)
+
+    await asyncio.gather(*[load_batch(batch_start_idx, min(batch_start_idx + RECORD_BATCH_SIZE, total_records))
+                           for batch_start_idx in range(0, total_records, RECORD_BATCH_SIZE)])
+
+    assert num_failed_documents == 0, f'{index_name}: {num_failed_documents} documents failed, run again with --resume to retry their batches'
+
+
+def get_record_fields(data, index_name, mapping=DEFAULT_MAPPING, id_fields=[]):
+    """(column position, field name) of the columns sent as record fields, and the positions of id_fields"""
+    fields = list(enumerate(clean_fields(data.columns)))
+
+    id_columns = [col_idx for id_field in id_fields
+                  for col_idx, field in fields if field == id_field]
+    assert len(id_columns) == len(
+        id_fields), f"{index_name}: missing id fields, expected {id_fields}"
+
+    # strict mappings reject unknown fields, so leave them out of the records
+    mapped_fields = get_mapped_fields(mapping)
+    if mapped_fields is not None:
+        unmapped = [field for _, field in fields if field not in mapped_fields]
+        if len(unmapped) > 0:
+            logger.info(f"{index_name}: not loading unmapped fields {unmapped}")
+        fields = [(col_idx, field) for col_idx, field in fields
+                  if field in mapped_fields]
+
+    return fields, id_columns
+
+
+def generate_records(data, fields, start_idx, end_idx, id_columns=[], chunk_size=int(1e4)):
+    """Lazily yield one record per row of data[start_idx:end_idx]
+
+    fields is a list of (column position, field name) to include, and the
+    values of the id_columns positions are joined into the record's _id
+
+    Rows are converted a chunk of columns at a time and missing values are
+    found per column, so only the fields that are present end up in a record
+    """
+    for chunk_start_idx in range(start_idx, end_idx, chunk_size):
+        chunk = data.iloc[chunk_start_idx:min(
+            chunk_start_idx + chunk_size, end_idx)]
+        num_rows = chunk.shape[0]
+
+        dense_fields = []
+        dense_values = []
+        sparse_columns = []
+        for col_idx, field in fields:
+            column = chunk.iloc[:, col_idx]
+            nans = column.isnull().values
+
+            if nans.all():
+                continue
+            elif nans.any():
+                sparse_columns.append(
+                    (field, column.tolist(), nans.tolist()))
+            else:
+                dense_fields.append(field)
+                dense_values.append(column.tolist())
+
+        if len(id_columns) > 0:
+            ids = np.asarray(chunk.iloc[:, id_columns[0]], dtype=object).astype(str)
+            for col_idx in id_columns[1:]:
+                ids = np.char.add(np.char.add(ids, "_"), np.asarray(
+                    chunk.iloc[:, col_idx], dtype=object).astype(str))
+
+            dense_fields.append("_id")
+            dense_values.append(ids.tolist())
+
+        rows = zip(*dense_values) if len(
+            dense_values) > 0 else [()] * num_rows
+
+        for row_idx, row in enumerate(rows):
+            record = dict(zip(dense_fields, row))
+            for field, values, nans in sparse_columns:
+                if not nans[row_idx]:
+                    record[field] = values[row_idx]
+            yield record
+
+
+def clean_fields(columns):
     invalid_chars = ['.']
-    invalid_cols = [col for col in data.columns if any(
-        [char in col for char in invalid_chars])]
-    for col in invalid_cols:
-        found_chars = [char for char in invalid_chars if char in col]
 
-        for char in found_chars:
-            new_col = col.replace(char, '_')
-            data.rename(columns={col: new_col}, inplace=True)
+    fields = []
+    for col in columns:
+        for char in invalid_chars:
+            col = col.replace(char, '_')
+        fields.append(col)
 
+    return fields
 
-def clean_nans(record):
-    floats = [field for field in record if isinstance(record[field], float)]
-    for field in floats:
-        if np.isnan(record[field]):
-            del record[field]
 
+def get_dashboard_entry(analysis_object, bins_layout=constants.BINS_LAYOUT_BIN):
+    record = analysis_object
+    record["mapping_version"] = MAPPING_VERSION
+    record["bins_layout"] = bins_layout
+    return record
 
 
-def load_dashboard_entry(analysis_object, dashboard_id, host, port):
-    record = analysis_object
+def load_dashboard_entry(analysis_object, dashboard_id, host, port, bins_layout=constants.BINS_LAYOUT_BIN):
+    record = get_dashboard_entry(analysis_object, bins_layout=bins_layout)
     # duplicate checking
     load_dashboard_record(record, dashboard_id, host, port)
 
 
+def finish_dashboard(analysis_object, dashboard_id, projects, host, port, bins_layout=constants.BINS_LAYOUT_BIN, roles=None, engine=constants.ENGINE_SYNC):
+    """Write the dashboard's analyses record and add it to its projects, at the same time with the async engine"""
+    if engine == constants.ENGINE_ASYNC:
+        run_async(finish_dashboard_async(analysis_object, dashboard_id, projects,
+                                         host, port, bins_layout=bins_layout, roles=roles))
+        return
+
+    load_dashboard_entry(analysis_object, dashboard_id, host, port, bins_layout=bins_layout)
+    add_dashboard_to_projects(dashboard_id, projects, host, port, roles=roles)
+
+
+async def finish_dashboard_async(analysis_object, dashboard_id, projects, host, port, bins_layout=constants.BINS_LAYOUT_BIN, roles=None):
+    record = get_dashboard_entry(analysis_object, bins_layout=bins_layout)
+
+    es = get_async_es(host, port)
+    # role updates go through the sync RoleManager, on a worker thread
+    await asyncio.gather(
+        load_record_async(es, record, dashboard_id,
+                          constants.DASHBOARD_ENTRY_INDEX),
+        run_in_thread(add_dashboard_to_projects, dashboard_id, projects, host, port, roles=roles))
+
+
 '''
 pass in an object which tells us what columns need to be relabeled
 what it needs to be joined on
@@ -249,7 +936,39 @@ def get_fitness_columns(directory):
         columns={"label": "cell_id", "index": "order"})
     order_df = order_df[["cell_id", "order"]]
 
-    return clone_df.merge(order_df).to_dict('records')
+    return FitnessColumns(clone_df.merge(order_df))
+
+
+class FitnessColumns(object):
+    """Fitness clone and order for each cell, indexed by cell key to join onto each library's QC data"""
+
+    def __init__(self, table):
+        table = table.set_index(pd.Index(get_cell_keys(table["cell_id"])))
+
+        duplicated = table.index.duplicated()
+        if duplicated.any():
+            logger.info(
+                f"Ignoring {duplicated.sum()} duplicate cells in fitness columns")
+            table = table[~duplicated]
+
+        self.table = table
+        self.num_matched = 0
+        self.unmatched_cells = []
+        self._lock = threading.Lock()
+
+    def count(self, cell_ids, matched):
+        unmatched_cells = list(np.asarray(cell_ids)[~matched])
+        if len(unmatched_cells) > 0:
+            logger.info(
+                f"{len(unmatched_cells)} of {len(matched)} cells have no fitness columns and are not loaded")
+
+        with self._lock:
+            self.num_matched += int(matched.sum())
+            self.unmatched_cells += unmatched_cells
+
+    def report(self):
+        logger.info(
+            f"Fitness columns: {self.num_matched} cells matched, {len(self.unmatched_cells)} unmatched {self.unmatched_cells[:10]}")
 
 def get_custom_analysis_object(dashboard_id):
     
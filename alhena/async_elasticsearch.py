@@ -0,0 +1,240 @@
+import time
+import atexit
+import asyncio
+import itertools
+import functools
+import threading
+
+from elasticsearch.exceptions import RequestError, TransportError
+
+import alhena.constants as constants
+from alhena.instrumentation import record_bulk
+from alhena.serializer import dumps_document
+from alhena.elasticsearch import get_client_options, get_bulk_slots, DEFAULT_MAPPING, FINGERPRINT_MAPPING
+
+try:
+    from elasticsearch import AsyncElasticsearch
+    from elasticsearch.helpers import async_streaming_bulk
+except ImportError:
+    # needs elasticsearch[async], which brings aiohttp
+    AsyncElasticsearch = None
+
+import logging
+logger = logging.getLogger('alhena_loading')
+
+
+ASYNC_OPTIONS = {
+    # batches of one index sent at the same time, each has at most one request in flight
+    "streams_per_index": 2,
+    "chunk_size": 100000,
+    "max_chunk_bytes": 5 * 1024 * 1024,
+    # records built at a time on a worker thread, off the event loop
+    "records_per_thread": 10000,
+    "max_retries": 8,
+    "initial_backoff": 2,
+    "max_backoff": 120
+}
+
+REJECTED_STATUS = 429
+
+# how often a bulk request waiting for a slot of the global budget checks again
+SLOT_POLL_SECONDS = 0.01
+
+# one event loop for the whole process, on its own thread, so its clients
+# (which belong to a loop) are shared by every load, as the sync ones are
+_loop = None
+_loop_lock = threading.Lock()
+
+# clients of the shared loop, keyed by (host, port), only used on the loop
+_clients = {}
+
+
+def is_async_available():
+    return AsyncElasticsearch is not None
+
+
+class AsyncBulkClient(object):
+    """Async client wrapper that takes a slot from the global budget for every bulk request and records its metrics
+
+    The budget is shared with the sync engine's threads, so its slots are
+    polled for rather than waited on, which would block the loop
+    """
+
+    def __init__(self, es, slots):
+        self._es = es
+        self._slots = slots
+
+    async def bulk(self, body, index=None, **kwargs):
+        num_bytes = len(body.encode("utf-8")) if isinstance(body, str) else len(body)
+        num_documents = body.count("\n") // 2 if isinstance(body, str) else 0
+
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(SLOT_POLL_SECONDS)
+        try:
+            start = time.time()
+            try:
+                response = await self._es.bulk(body=body, index=index, **kwargs)
+            except TransportError as err:
+                if err.status_code == REJECTED_STATUS:
+                    record_bulk(index, 0, num_bytes, time.time() - start,
+                                rejected=num_documents)
+                raise
+            latency = time.time() - start
+        finally:
+            self._slots.release()
+
+        num_rejected = 0
+        num_failed = 0
+        if response["errors"]:
+            for item in response["items"]:
+                result = list(item.values())[0]
+                if result["status"] == REJECTED_STATUS:
+                    num_rejected += 1
+                elif "error" in result:
+                    num_failed += 1
+
+        record_bulk(index, len(response["items"]) - num_rejected - num_failed, num_bytes,
+                    latency, rejected=num_rejected, failed=num_failed)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._es, name)
+
+
+def run_async(coroutine):
+    """Run coroutine on the shared event loop, from any thread but the loop's, returning its result"""
+    global _loop
+    assert is_async_available(
+    ), 'The async engine needs the async Elasticsearch client, install elasticsearch[async]'
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever,
+                             name="async-loader", daemon=True).start()
+            atexit.register(close_async_es)
+        loop = _loop
+
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def get_async_es(host, port):
+    """Async client of the shared loop for host and port, opened on first use. Call on the loop"""
+    if (host, port) not in _clients:
+        logger.debug(f'Opening async connection pool to {host}:{port}')
+        _clients[(host, port)] = AsyncBulkClient(
+            AsyncElasticsearch(**get_client_options(host, port)), get_bulk_slots())
+
+    return _clients[(host, port)]
+
+
+def close_async_es():
+    """Close the shared loop's clients"""
+    with _loop_lock:
+        loop = _loop
+    if loop is None or len(_clients) == 0:
+        return
+
+    async def close():
+        for es in _clients.values():
+            await es.close()
+        _clients.clear()
+
+    asyncio.run_coroutine_threadsafe(close(), loop).result()
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run blocking work (pandas transforms, sync client calls) on the loop's thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+async def iterate_in_thread(iterable, chunk_size=None):
+    """Yield from a blocking iterable, taking chunk_size items at a time on a worker thread"""
+    chunk_size = chunk_size or ASYNC_OPTIONS["records_per_thread"]
+    iterator = iter(iterable)
+
+    while True:
+        chunk = await run_in_thread(list, itertools.islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            return
+
+        for item in chunk:
+            yield item
+
+
+async def create_index_async(es, index, mapping=DEFAULT_MAPPING):
+    if await es.indices.exists(index=index):
+        return
+
+    logger.info(f'No index found - creating index named {index}')
+    try:
+        await es.indices.create(index=index, body=mapping)
+    except RequestError as err:
+        # another index of the load got there first
+        if err.error != 'resource_already_exists_exception':
+            raise
+
+
+def _expand_record(record):
+    action = {}
+    if "_id" in record:
+        action["_id"] = record.pop("_id")
+    # encoded here as the client serializer keeps missing fields
+    return {"index": action}, dumps_document(record).decode("utf-8")
+
+
+async def bulk_async(es, records, index_name):
+    """Index records (an iterable or async iterable) into index_name, returning (number indexed, number failed)
+
+    Rejected documents are retried with exponential backoff by async_streaming_bulk
+    """
+    num_documents = 0
+    num_failed = 0
+
+    async def counted(records):
+        nonlocal num_documents
+        async for record in _aiter(records):
+            num_documents += 1
+            yield record
+
+    async for ok, item in async_streaming_bulk(es, counted(records),
+                                               chunk_size=ASYNC_OPTIONS["chunk_size"],
+                                               max_chunk_bytes=ASYNC_OPTIONS["max_chunk_bytes"],
+                                               expand_action_callback=_expand_record,
+                                               raise_on_error=False,
+                                               max_retries=ASYNC_OPTIONS["max_retries"],
+                                               initial_backoff=ASYNC_OPTIONS["initial_backoff"],
+                                               max_backoff=ASYNC_OPTIONS["max_backoff"],
+                                               yield_ok=False,
+                                               index=index_name):
+        if not ok:
+            logger.info(list(item.values())[0].get("error"))
+            logger.info('Doc failed in async loading')
+            num_failed += 1
+
+    return num_documents - num_failed, num_failed
+
+
+async def load_record_async(es, record, record_id, index, mapping=DEFAULT_MAPPING):
+    await create_index_async(es, index, mapping=mapping)
+    logger.info(f'Loading record {record_id} into {index}')
+    return await es.index(index=index, id=record_id, body=record)
+
+
+async def save_fingerprints_async(es, dashboard_id, index_name, source, fingerprints):
+    await load_record_async(es, {
+        "dashboard_id": dashboard_id,
+        "index": index_name,
+        "source": source,
+        "fingerprints": fingerprints
+    }, f"{index_name}:{source}", constants.FINGERPRINT_INDEX, mapping=FINGERPRINT_MAPPING)
+
+
+async def _aiter(iterable):
+    if hasattr(iterable, "__aiter__"):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
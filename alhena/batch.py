@@ -0,0 +1,171 @@
+import os
+import csv
+import time
+import logging
+import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import alhena.constants as constants
+
+from alhena.alhena_loader import load_analysis, load_merged_analysis
+from alhena.preflight import get_preflight
+from alhena.tantalus_colossus import get_colossus_tantalus_data, get_colossus_tantalus_analysis_object
+from alhena.isabl import get_scgenome_isabl_data, get_scgenome_isabl_annotation_pk, get_isabl_analysis_object
+
+logger = logging.getLogger('alhena_loading')
+
+SOURCES = ["single", "merged", "isabl"]
+
+
+def read_manifest(manifest_path):
+    """Read dashboards to load from a CSV or YAML manifest
+
+    Each entry has an id, a source (single, merged or isabl), a directory
+    (not needed for isabl), projects (a list, or ; separated in CSV) and
+    optionally a bins_layout overriding the one given for the batch
+    """
+    _, extension = os.path.splitext(manifest_path)
+
+    with open(manifest_path) as manifest_file:
+        if extension in [".yaml", ".yml"]:
+            entries = yaml.safe_load(manifest_file)
+        else:
+            entries = list(csv.DictReader(manifest_file))
+
+    manifest = []
+    for entry in entries:
+        assert "id" in entry and entry["id"], f"Manifest entry without id: {entry}"
+
+        source = entry.get("source") or "single"
+        assert source in SOURCES, f'Unknown source {source} for {entry["id"]}, expected one of {SOURCES}'
+
+        projects = entry.get("projects") or ["DLP"]
+        if isinstance(projects, str):
+            projects = [project.strip()
+                        for project in projects.split(";") if project.strip()]
+
+        bins_layout = entry.get("bins_layout") or None
+        assert bins_layout is None or bins_layout in constants.BINS_LAYOUTS, f'Unknown bins layout {bins_layout} for {entry["id"]}, expected one of {constants.BINS_LAYOUTS}'
+
+        manifest.append({
+            "id": str(entry["id"]),
+            "source": source,
+            "directory": entry.get("directory"),
+            "projects": list(projects),
+            "bins_layout": bins_layout
+        })
+
+    return manifest
+
+
+def load_batch(manifest, host, port, workers=4, reload=False, merged_kwargs={}, **load_kwargs):
+    """Load every dashboard in the manifest on a pool of workers, returning one result per dashboard"""
+
+    # preflight once for the whole batch instead of once per dashboard, its
+    # project roles are then written once at the end of the batch
+    preflight = get_preflight(host, port)
+    roles = preflight.roles
+
+    missing_projects = set(preflight.get_missing_projects(
+        [project for entry in manifest for project in entry["projects"]]))
+    loaded = preflight.get_loaded(
+        [entry["id"] for entry in manifest if entry["source"] != "isabl"])
+
+    def run(entry):
+        start = time.time()
+        result = {"id": entry["id"], "source": entry["source"]}
+
+        entry_missing_projects = [
+            project for project in entry["projects"] if project in missing_projects]
+
+        try:
+            if len(entry_missing_projects) > 0:
+                raise ValueError(
+                    f'Projects do not exist: {entry_missing_projects}')
+
+            # delta loads update a loaded dashboard in place
+            if not reload and not load_kwargs.get("delta", False) and loaded.get(entry["id"], False):
+                result["status"] = "skipped"
+            elif load_entry(entry, host, port, reload=reload,
+                            merged_kwargs=merged_kwargs, roles=roles, **load_kwargs):
+                result["status"] = "loaded"
+                if entry["source"] != "isabl":
+                    preflight.set_loaded(entry["id"])
+            else:
+                result["status"] = "skipped"
+
+        except Exception as err:
+            logger.exception(f'Failed to load {entry["id"]}')
+            result["status"] = "failed"
+            result["error"] = str(err)
+
+        result["seconds"] = round(time.time() - start, 1)
+        return result
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, entry) for entry in manifest]
+
+            for future in as_completed(futures):
+                result = future.result()
+                logger.info(
+                    f'{result["id"]}: {result["status"]} in {result["seconds"]}s')
+                results.append(result)
+    finally:
+        # dashboards loaded before a failure are still added to their projects
+        roles.flush()
+
+    return results
+
+
+def load_entry(entry, host, port, reload=False, merged_kwargs={}, **load_kwargs):
+    """Load one manifest entry, returning False if it was skipped as already loaded"""
+    dashboard_id = entry["id"]
+    source = entry["source"]
+    directory = entry["directory"]
+    projects = entry["projects"]
+
+    if entry.get("bins_layout") is not None:
+        load_kwargs = {**load_kwargs, "bins_layout": entry["bins_layout"]}
+
+    if source == "isabl":
+        # isabl dashboards are keyed by their annotation analysis
+        experiment_id = dashboard_id
+        dashboard_id = str(get_scgenome_isabl_annotation_pk(experiment_id))
+
+        if not reload and get_preflight(host, port).is_loaded(dashboard_id):
+            logger.info(f'{dashboard_id} already loaded')
+            return False
+
+        hmmcopy_data = get_scgenome_isabl_data(experiment_id)
+        analysis_record = get_isabl_analysis_object(dashboard_id)
+        load_analysis(dashboard_id, hmmcopy_data, analysis_record,
+                      projects, None, host, port, **load_kwargs)
+        return True
+
+    if source == "merged":
+        load_merged_analysis(dashboard_id, projects,
+                             directory, host, port, **load_kwargs, **merged_kwargs)
+
+    else:
+        hmmcopy_data = get_colossus_tantalus_data(directory)
+        analysis_record = get_colossus_tantalus_analysis_object(
+            directory, dashboard_id)
+        load_analysis(dashboard_id, hmmcopy_data, analysis_record,
+                      projects, directory, host, port, **load_kwargs)
+
+    return True
+
+
+def format_summary(results):
+    lines = [f'{"id":<24}{"source":<10}{"status":<10}{"seconds":>10}  error']
+    for result in sorted(results, key=lambda result: result["id"]):
+        lines.append(
+            f'{result["id"]:<24}{result["source"]:<10}{result["status"]:<10}{result["seconds"]:>10}  {result.get("error", "")}')
+
+    failed = [result for result in results if result["status"] == "failed"]
+    lines.append(
+        f'{len(results)} dashboards, {len(failed)} failed, {sum(result["seconds"] for result in results):.1f}s total')
+
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from elasticsearch.exceptions import TransportError, ConnectionTimeout
+from alhena.instrumentation import record_bulk
+from alhena.serializer import bulk_lines
+
+logger = logging.getLogger('alhena_loading')
+
+BULK_OPTIONS = {
+    "initial_chunk_bytes": 5 * 1024 * 1024,
+    "min_chunk_bytes": 512 * 1024,
+    # stays well under the default http.max_content_length of 100mb
+    "max_chunk_bytes": 50 * 1024 * 1024,
+    "initial_threads": 2,
+    "max_threads": 8,
+    # bulk requests slower than this shrink the chunk size
+    "target_latency": 10.0,
+    "max_retries": 8,
+    "initial_backoff": 2.0,
+    "max_backoff": 120.0
+}
+
+REJECTED_STATUS = 429
+
+
+class BulkController(object):
+    """Sends bulk requests, sizing them by bytes and adapting to the cluster
+
+    Chunks grow while requests come back quickly and without rejections, then
+    more requests are sent in parallel. Rejections (429) or slow responses
+    shrink the chunks and parallelism again. Rejected documents are retried
+    with exponential backoff instead of being dropped.
+    """
+
+    def __init__(self, **options):
+        self.options = {**BULK_OPTIONS, **options}
+        self.chunk_bytes = self.options["initial_chunk_bytes"]
+        self.threads = self.options["initial_threads"]
+        self._lock = threading.Lock()
+
+    def bulk_lines(self, es, lines, index_name, on_done=None):
+        """Send already encoded action and document line pairs to index_name, returning (number indexed, number failed)
+
+        on_done(start, count, number indexed, number failed) is called, from
+        this thread, as each request finishes with the position of its line
+        pairs in lines
+        """
+        num_success = 0
+        num_failed = 0
+
+        def collect(futures):
+            nonlocal num_success, num_failed
+            for future in futures:
+                start, count = inflight.pop(future)
+                success, failed = self._record(*future.result())
+                num_success += success
+                num_failed += failed
+                if on_done is not None:
+                    on_done(start, count, success, failed)
+
+        inflight = {}
+        with ThreadPoolExecutor(max_workers=self.options["max_threads"]) as executor:
+            for start, chunk in self._chunks(lines):
+                while len(inflight) >= self.threads:
+                    done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                future = executor.submit(self._send, es, chunk, index_name)
+                inflight[future] = (start, len(chunk))
+
+            collect(wait(inflight).done)
+
+        return num_success, num_failed
+
+    def _chunks(self, lines):
+        """Yield (position of the first pair, pairs) chunks of about chunk_bytes"""
+        chunk = []
+        chunk_bytes = 0
+        start = 0
+        for pair in lines:
+            chunk.append(pair)
+            chunk_bytes += len(pair)
+
+            if chunk_bytes >= self.chunk_bytes:
+                yield start, chunk
+                start += len(chunk)
+                chunk = []
+                chunk_bytes = 0
+
+        if len(chunk) > 0:
+            yield start, chunk
+
+    def _send(self, es, chunk, index_name):
+        """Send one chunk, retrying rejected documents. Runs on a worker thread"""
+        backoff = self.options["initial_backoff"]
+        latency = None
+        num_rejections = 0
+        num_failed = 0
+        num_documents = len(chunk)
+
+        for attempt in range(self.options["max_retries"] + 1):
+            if attempt > 0:
+                logger.info(
+                    f'Retrying {len(chunk)} rejected documents in {backoff}s')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.options["max_backoff"])
+
+            body = b"".join(chunk)
+            num_bytes = len(body)
+
+            start = time.time()
+            try:
+                response = es.bulk(body=body, index=index_name)
+            except (ConnectionTimeout, TransportError) as err:
+                if not _is_retryable(err):
+                    raise
+                num_rejections += 1
+                record_bulk(index_name, 0, num_bytes,
+                            time.time() - start, rejected=len(chunk))
+                continue
+            finally:
+                latency = time.time() - start
+
+            if not response["errors"]:
+                record_bulk(index_name, len(chunk), num_bytes, latency)
+                return num_documents, num_failed, num_rejections, latency
+
+            rejected = []
+            num_attempt_failed = 0
+            for lines, item in zip(chunk, response["items"]):
+                result = list(item.values())[0]
+                if result["status"] == REJECTED_STATUS:
+                    rejected.append(lines)
+                elif "error" in result:
+                    logger.info(result["error"])
+                    logger.info('Doc failed in parallel loading')
+                    num_attempt_failed += 1
+
+            num_failed += num_attempt_failed
+            record_bulk(index_name, len(chunk) - len(rejected) - num_attempt_failed, num_bytes,
+                        latency, rejected=len(rejected), failed=num_attempt_failed)
+
+            if len(rejected) == 0:
+                return num_documents - num_failed, num_failed, num_rejections, latency
+
+            num_rejections += 1
+            chunk = rejected
+
+        logger.info(
+            f'{len(chunk)} documents still rejected after {self.options["max_retries"]} retries')
+        num_failed += len(chunk)
+        return num_documents - num_failed, num_failed, num_rejections, latency
+
+    def _record(self, num_success, num_failed, num_rejections, latency):
+        """Adapt chunk size and parallelism to how a request went"""
+        with self._lock:
+            if num_rejections > 0:
+                self.chunk_bytes = max(
+                    self.chunk_bytes // 2, self.options["min_chunk_bytes"])
+                self.threads = max(self.threads - 1, 1)
+                logger.info(
+                    f'Bulk rejected, reducing to {self.threads} threads of {self.chunk_bytes // 1024}kb chunks')
+
+            elif latency > self.options["target_latency"]:
+                self.chunk_bytes = max(
+                    int(self.chunk_bytes * 0.75), self.options["min_chunk_bytes"])
+                logger.debug(
+                    f'Bulk took {latency:.1f}s, reducing chunks to {self.chunk_bytes // 1024}kb')
+
+            elif latency < self.options["target_latency"] / 2:
+                if self.chunk_bytes < self.options["max_chunk_bytes"]:
+                    self.chunk_bytes = min(
+                        int(self.chunk_bytes * 1.25), self.options["max_chunk_bytes"])
+                elif self.threads < self.options["max_threads"]:
+                    self.threads += 1
+                    logger.debug(f'Increasing to {self.threads} bulk threads')
+
+        return num_success, num_failed
+
+
+def encode_records(records, index_name):
+    """Yield the encoded action and document line pair of each record"""
+    for record in records:
+        action = {"_index": index_name}
+        if "_id" in record:
+            action["_id"] = record.pop("_id")
+
+        yield bulk_lines({"index": action}, record)
+
+
+def _is_retryable(err):
+    if isinstance(err, ConnectionTimeout):
+        return True
+    return err.status_code in [REJECTED_STATUS, 502, 503, 504]
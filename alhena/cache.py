@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import pandas as pd
+
+logger = logging.getLogger('alhena_loading')
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# only the tables the loader turns into indices are cached
+CACHED_TABLES = ["hmmcopy_reads", "hmmcopy_segs",
+                 "annotation_metrics", "gc_metrics"]
+
+CACHE_OPTIONS = {
+    "directory": os.environ.get('ALHENA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'alhena')),
+    "max_bytes": int(float(os.environ.get('ALHENA_CACHE_MAX_GB', 50)) * 1024 ** 3)
+}
+
+METADATA_FILENAME = "metadata.json"
+
+
+def configure_cache(directory=None, max_gb=None):
+    if directory is not None:
+        CACHE_OPTIONS["directory"] = directory
+    if max_gb is not None:
+        CACHE_OPTIONS["max_bytes"] = int(max_gb * 1024 ** 3)
+
+
+def is_cache_enabled():
+    return pyarrow is not None and CACHE_OPTIONS["max_bytes"] > 0
+
+
+def get_directory_key(directory):
+    """Key for the pipeline results in directory, changing whenever a file is added, removed or modified"""
+    directory = os.path.abspath(directory)
+
+    files = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            files.append(
+                (os.path.relpath(path, directory), stat.st_size, stat.st_mtime_ns))
+
+    return _hash_key(directory, sorted(files))
+
+
+def get_isabl_key(*analysis_pks):
+    return _hash_key("isabl", list(analysis_pks))
+
+
+def _hash_key(*parts):
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+
+def get_cached_data(key, source, load):
+    """CACHED_TABLES for key from the cache, or from load() and then cached, whether or not the cache is used"""
+    if not is_cache_enabled():
+        return get_cached_tables(load())
+
+    entry_directory = os.path.join(CACHE_OPTIONS["directory"], key)
+
+    if os.path.exists(os.path.join(entry_directory, METADATA_FILENAME)):
+        logger.info(f'Reading {source} from cache {entry_directory}')
+        try:
+            data = {table_name: pd.read_parquet(os.path.join(entry_directory, f"{table_name}.parquet"))
+                    for table_name in CACHED_TABLES}
+            # last use time drives eviction
+            os.utime(os.path.join(entry_directory, METADATA_FILENAME))
+            return data
+        except (OSError, ValueError) as err:
+            logger.info(f'Ignoring unreadable cache entry {key}: {err}')
+
+    data = get_cached_tables(load())
+    save_cached_data(key, source, data)
+
+    return data
+
+
+def get_cached_tables(data):
+    return {table_name: data[table_name] for table_name in CACHED_TABLES}
+
+
+def save_cached_data(key, source, data):
+    os.makedirs(CACHE_OPTIONS["directory"], exist_ok=True)
+    entry_directory = os.path.join(CACHE_OPTIONS["directory"], key)
+
+    # written aside and moved in place, so readers never see a partial entry
+    temp_directory = tempfile.mkdtemp(dir=CACHE_OPTIONS["directory"])
+    try:
+        for table_name in CACHED_TABLES:
+            data[table_name].to_parquet(os.path.join(
+                temp_directory, f"{table_name}.parquet"))
+
+        with open(os.path.join(temp_directory, METADATA_FILENAME), 'w') as metadata_file:
+            json.dump({"source": source, "created": time.time()}, metadata_file)
+
+        shutil.rmtree(entry_directory, ignore_errors=True)
+        os.rename(temp_directory, entry_directory)
+
+    except Exception as err:
+        logger.info(f'Could not cache {source}: {err}')
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        return
+
+    evict_cache(CACHE_OPTIONS["max_bytes"])
+
+
+def get_cache_entries():
+    """Cache entries, most recently used first"""
+    directory = CACHE_OPTIONS["directory"]
+    if not os.path.isdir(directory):
+        return []
+
+    entries = []
+    for key in os.listdir(directory):
+        metadata_path = os.path.join(directory, key, METADATA_FILENAME)
+        if not os.path.exists(metadata_path):
+            continue
+
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+
+        entry_directory = os.path.join(directory, key)
+        entries.append({
+            "key": key,
+            "source": metadata["source"],
+            "created": metadata["created"],
+            "last_used": os.path.getmtime(metadata_path),
+            "bytes": sum(os.path.getsize(os.path.join(entry_directory, filename))
+                         for filename in os.listdir(entry_directory))
+        })
+
+    return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+
+def evict_cache(max_bytes):
+    total_bytes = 0
+    for entry in get_cache_entries():
+        total_bytes += entry["bytes"]
+        if total_bytes > max_bytes:
+            logger.info(f'Evicting {entry["source"]} from cache')
+            purge_cache(entry["key"])
+
+
+def purge_cache(key=None):
+    directory = CACHE_OPTIONS["directory"]
+
+    if key is None:
+        shutil.rmtree(directory, ignore_errors=True)
+    else:
+        shutil.rmtree(os.path.join(directory, key), ignore_errors=True)
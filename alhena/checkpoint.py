@@ -0,0 +1,65 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger('alhena_loading')
+
+CHECKPOINT_DIRECTORY = 'checkpoints/'
+
+
+class Checkpoint(object):
+    """Batches of a dashboard load that have been fully indexed, kept in a local file
+
+    Documents have deterministic IDs, so re-sending a batch that was partly
+    indexed before a failure overwrites rather than duplicates it
+    """
+
+    def __init__(self, dashboard_id, resume=False, directory=CHECKPOINT_DIRECTORY):
+        self.path = os.path.join(directory, f'{dashboard_id}.json')
+        self._lock = threading.Lock()
+        self._batches = {}
+        # index version being loaded into, so a resumed load continues the same one
+        self.version = None
+
+        if resume and os.path.exists(self.path):
+            with open(self.path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            self._batches = checkpoint["batches"]
+            self.version = checkpoint.get("version")
+            logger.info(
+                f'Resuming from {self.path} with {len(self._batches)} completed batches')
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self._save()
+
+    @staticmethod
+    def batch_key(index_name, source, batch_start_idx, batch_end_idx, total_records):
+        # the table size is part of the key so a changed input is never skipped
+        return f'{index_name}:{source}:{batch_start_idx}-{batch_end_idx}/{total_records}'
+
+    def set_version(self, version):
+        with self._lock:
+            self.version = version
+            self._save()
+
+    def is_done(self, key):
+        with self._lock:
+            return key in self._batches
+
+    def mark_done(self, key, num_records):
+        with self._lock:
+            self._batches[key] = num_records
+            self._save()
+
+    def finish(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump({"version": self.version, "batches": self._batches},
+                      checkpoint_file)
+        os.replace(temp_path, self.path)
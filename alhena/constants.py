@@ -1,7 +1,42 @@
 
 DASHBOARD_ENTRY_INDEX = "analyses"
-DATA_TYPES = ["qc", "segs", "bins", "gc_bias"]
+FINGERPRINT_INDEX = "alhena_fingerprints"
+# coarser copies of bins, by bin size in bp (None for chromosome arms), to
+# query zoomed out views from; indexed as <dashboard_id>_bins_<level>
+BIN_LEVELS = {
+    "bins_1mb": int(1e6),
+    "bins_5mb": int(5e6),
+    "bins_10mb": int(1e7),
+    "bins_arm": None
+}
+# bins are indexed one document per bin, or packed into one document per cell
+# and chromosome with arrays of the bin values
+BINS_LAYOUT_BIN = "bin"
+BINS_LAYOUT_PACKED = "packed"
+BINS_LAYOUTS = [BINS_LAYOUT_BIN, BINS_LAYOUT_PACKED]
+PACKED_BINS_FIELDS = ["start", "copy", "state", "reads"]
+
+# loads run on the sync client with threads, or on the async client with one
+# event loop overlapping the requests of every index
+ENGINE_SYNC = "sync"
+ENGINE_ASYNC = "async"
+ENGINES = [ENGINE_SYNC, ENGINE_ASYNC]
+
+# one document per cell summarizing its copy number, for single document lookups
+CELL_SUMMARY_TYPE = "cell_summary"
+DATA_TYPES = ["qc", "segs", "bins", "gc_bias"] + \
+    list(BIN_LEVELS.keys()) + [CELL_SUMMARY_TYPE]
 METADATA_FILENAME = "metadata.json"
 MERGED_DIRECTORYNAME = "merged"
 
 COLOSSUS_BASE_URL = "https://colossus.canadacentral.cloudapp.azure.com/api"
+
+# GRCh37 centromere start positions, bins starting at or after are on the q arm
+CENTROMERE_STARTS = {
+    "1": 121535434, "2": 92326171, "3": 90504854, "4": 49660117,
+    "5": 46405641, "6": 58830166, "7": 58054331, "8": 43838887,
+    "9": 47367679, "10": 39254935, "11": 51644205, "12": 34856694,
+    "13": 16000000, "14": 16000000, "15": 17000000, "16": 35335801,
+    "17": 22263006, "18": 15460898, "19": 24681782, "20": 26369569,
+    "21": 11288129, "22": 13000000, "X": 58632012, "Y": 10104553
+}
@@ -1,9 +1,15 @@
 import urllib3
 from elasticsearch import Elasticsearch
-from elasticsearch import helpers
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch.exceptions import NotFoundError, RequestError
 import alhena.constants as constants
+from alhena.bulk import BulkController
+from alhena.serializer import BulkSerializer
+from alhena.roles import RoleManager
 import os
+import re
+import fnmatch
+import threading
+import contextlib
 
 import logging
 logger = logging.getLogger('alhena_loading')
@@ -33,17 +39,347 @@ DEFAULT_MAPPING = {
 }
 
 
+# Bump whenever DATA_TYPE_MAPPINGS changes, it is stored on each index and
+# on the dashboard record so index size can be compared between versions
+MAPPING_VERSION = 2
+
+KEYWORD = {"type": "keyword"}
+# stored in _source only: not searchable and not aggregatable
+UNINDEXED_KEYWORD = {"type": "keyword", "index": False, "doc_values": False}
+UNINDEXED_FLOAT = {"type": "half_float", "index": False, "doc_values": False}
+UNINDEXED_BOOLEAN = {"type": "boolean", "index": False, "doc_values": False}
+POSITION = {"type": "integer"}
+STATE = {"type": "byte"}
+COPY_NUMBER = {"type": "scaled_float", "scaling_factor": 100, "index": False}
+
+
+def _strict_mapping(properties):
+    return {
+        "settings": DEFAULT_MAPPING["settings"],
+        "mappings": {
+            "dynamic": "strict",
+            "_meta": {"mapping_version": MAPPING_VERSION},
+            "properties": properties
+        }
+    }
+
+
+DATA_TYPE_MAPPINGS = {
+    # annotation metrics vary between pipeline versions, so qc stays dynamic
+    # but with narrower types than the defaults
+    "qc": {
+        "settings": DEFAULT_MAPPING["settings"],
+        "mappings": {
+            "dynamic": True,
+            "_meta": {"mapping_version": MAPPING_VERSION},
+            "dynamic_templates": DEFAULT_MAPPING["mappings"]["dynamic_templates"] + [
+                {
+                    "float_values": {
+                        "match": "*",
+                        "match_mapping_type": "double",
+                        "mapping": {
+                            "type": "float"
+                        }
+                    }
+                }
+            ],
+            "properties": {
+                "cell_id": KEYWORD,
+                "sample_id": KEYWORD,
+                "library_id": KEYWORD,
+                "is_contaminated": KEYWORD,
+                "percent_unmapped_reads": {"type": "float"},
+                "order": {"type": "integer"},
+                "clone_id": KEYWORD
+            }
+        }
+    },
+    "segs": _strict_mapping({
+        "cell_id": KEYWORD,
+        "sample_id": KEYWORD,
+        "library_id": KEYWORD,
+        "chr": KEYWORD,
+        "chrom_number": KEYWORD,
+        "start": POSITION,
+        "end": POSITION,
+        "state": STATE,
+        "median": COPY_NUMBER,
+        "multiplier": {"type": "byte", "index": False, "doc_values": False}
+    }),
+    "bins": _strict_mapping({
+        "cell_id": KEYWORD,
+        "sample_id": KEYWORD,
+        "library_id": KEYWORD,
+        "chr": KEYWORD,
+        "chrom_number": KEYWORD,
+        "start": POSITION,
+        "end": POSITION,
+        "state": STATE,
+        "copy": COPY_NUMBER,
+        "reads": {"type": "integer", "index": False},
+        "gc": UNINDEXED_FLOAT,
+        "map": UNINDEXED_FLOAT,
+        "cor_gc": UNINDEXED_FLOAT,
+        "cor_map": UNINDEXED_FLOAT,
+        "modal_curve": UNINDEXED_FLOAT,
+        "modal_quantile": UNINDEXED_FLOAT,
+        "mad_quantile": UNINDEXED_FLOAT,
+        "multiplier": {"type": "byte", "index": False, "doc_values": False},
+        "valid": UNINDEXED_BOOLEAN,
+        "ideal": UNINDEXED_BOOLEAN
+    }),
+    **{level: _strict_mapping({
+        "cell_id": KEYWORD,
+        "chr": KEYWORD,
+        "chrom_number": KEYWORD,
+        "arm": KEYWORD,
+        "start": POSITION,
+        "end": POSITION,
+        "state": STATE,
+        "copy": COPY_NUMBER,
+        "reads": {"type": "integer", "index": False},
+        "num_bins": {"type": "short", "index": False, "doc_values": False}
+    }) for level in constants.BIN_LEVELS},
+    # state fraction and per chromosome columns depend on the data
+    constants.CELL_SUMMARY_TYPE: {
+        "settings": DEFAULT_MAPPING["settings"],
+        "mappings": {
+            "dynamic": True,
+            "_meta": {"mapping_version": MAPPING_VERSION},
+            "dynamic_templates": [
+                {
+                    "summary_values": {
+                        "match": "state_fraction_*",
+                        "mapping": {"type": "half_float", "index": False}
+                    }
+                },
+                {
+                    "chromosome_values": {
+                        "match": "mean_copy_chr_*",
+                        "mapping": COPY_NUMBER
+                    }
+                }
+            ],
+            "properties": {
+                "cell_id": KEYWORD,
+                "ploidy": {"type": "half_float"},
+                "mean_copy": COPY_NUMBER,
+                "num_bins": {"type": "integer", "index": False},
+                "num_segments": {"type": "integer"}
+            }
+        }
+    },
+    "gc_bias": _strict_mapping({
+        "cell_id": KEYWORD,
+        "gc_percent": {"type": "byte"},
+        "value": {"type": "half_float", "index": False}
+    })
+}
+
+
+# bins packed one document per cell and chromosome, the arrays are only kept in _source
+PACKED_BINS_MAPPING = _strict_mapping({
+    "cell_id": KEYWORD,
+    "sample_id": KEYWORD,
+    "library_id": KEYWORD,
+    "chr": KEYWORD,
+    "chrom_number": KEYWORD,
+    "num_bins": {"type": "short", "index": False, "doc_values": False},
+    "start": {"type": "integer", "index": False, "doc_values": False},
+    "copy": UNINDEXED_FLOAT,
+    "state": {"type": "byte", "index": False, "doc_values": False},
+    "reads": {"type": "integer", "index": False, "doc_values": False}
+})
+
+
+# per-cell fingerprints of what was loaded into each index, used by delta loads
+FINGERPRINT_MAPPING = {
+    "mappings": {
+        "dynamic": "strict",
+        "properties": {
+            "dashboard_id": KEYWORD,
+            "index": KEYWORD,
+            "source": KEYWORD,
+            "fingerprints": {"type": "object", "enabled": False}
+        }
+    }
+}
+
+
+def get_mapping(data_type, bins_layout=constants.BINS_LAYOUT_BIN):
+    if data_type == "bins" and bins_layout == constants.BINS_LAYOUT_PACKED:
+        return PACKED_BINS_MAPPING
+    return DATA_TYPE_MAPPINGS.get(data_type, DEFAULT_MAPPING)
+
+
+def get_mapped_fields(mapping):
+    """Fields that may be sent to an index with this mapping, or None if it accepts any field"""
+    if mapping["mappings"].get("dynamic") != "strict":
+        return None
+
+    return set(mapping["mappings"]["properties"].keys())
+
+
+# Applied while bulk loading: no periodic refreshes and no replica copies.
+# The index's own values are put back once loading is done
+INGEST_SETTINGS = {
+    "index.refresh_interval": "-1",
+    "index.number_of_replicas": 0
+}
+
+
+# Clients are shared for the whole process, keyed by host/port/credentials,
+# so every batch of a load reuses the same connection pool
+ES_CLIENT_OPTIONS = {
+    "pool_size": 10,
+    "keep_alive": True,
+    # bulk requests in flight across all indices, so --concurrent loads
+    # cannot flood the cluster
+    "max_inflight_bulk": 8,
+    "scheme": "https"
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# indices known to exist, keyed by (host, port)
+_known_indices = {}
+
+# global budget of bulk requests in flight across all loader threads
+_bulk_slots = threading.BoundedSemaphore(ES_CLIENT_OPTIONS["max_inflight_bulk"])
+
+# one adaptive controller per cluster, so what is learned about the cluster
+# carries over between batches and indices
+_bulk_controllers = {}
+
+
+def configure_es(pool_size=None, keep_alive=None, max_inflight_bulk=None, scheme=None):
+    global _bulk_slots
+
+    if pool_size is not None:
+        ES_CLIENT_OPTIONS["pool_size"] = pool_size
+    if keep_alive is not None:
+        ES_CLIENT_OPTIONS["keep_alive"] = keep_alive
+    if max_inflight_bulk is not None:
+        ES_CLIENT_OPTIONS["max_inflight_bulk"] = max_inflight_bulk
+        _bulk_slots = threading.BoundedSemaphore(max_inflight_bulk)
+    if scheme is not None:
+        ES_CLIENT_OPTIONS["scheme"] = scheme
+
+    close_es()
+
+
+def get_client_options(host, port):
+    """Keyword arguments of a client for host and port, shared by the sync and async clients"""
+    user = os.environ.get('ALHENA_ES_USER')
+    password = os.environ.get('ALHENA_ES_PASSWORD')
+    assert user is not None and password is not None, 'Elasticsearch credentials missing'
+
+    headers = {} if ES_CLIENT_OPTIONS["keep_alive"] else {
+        'Connection': 'close'}
+
+    return {
+        "hosts": [{'host': host, 'port': port}],
+        "http_auth": (user, password),
+        "scheme": ES_CLIENT_OPTIONS["scheme"],
+        "timeout": 300,
+        "verify_certs": False,
+        "maxsize": ES_CLIENT_OPTIONS["pool_size"],
+        "headers": headers,
+        "serializer": BulkSerializer()
+    }
+
+
 def initialize_es(host, port):
-    assert os.environ['ALHENA_ES_USER'] is not None and os.environ['ALHENA_ES_PASSWORD'] is not None, 'Elasticsearch credentials missing'
+    options = get_client_options(host, port)
+    key = (host, port) + options["http_auth"]
+
+    with _clients_lock:
+        if key not in _clients:
+            logger.debug(f'Opening connection pool to {host}:{port}')
+            _clients[key] = Elasticsearch(**options)
+
+        return _clients[key]
+
+
+class BulkLimitedClient(object):
+    """Client wrapper that takes a slot from the global budget for every bulk request"""
+
+    def __init__(self, es, slots):
+        self._es = es
+        self._slots = slots
+
+    def bulk(self, *args, **kwargs):
+        with self._slots:
+            return self._es.bulk(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._es, name)
+
+
+def get_bulk_slots():
+    return _bulk_slots
+
+
+def get_bulk_client(host, port):
+    return BulkLimitedClient(initialize_es(host, port), get_bulk_slots())
+
+
+def get_bulk_controller(host, port):
+    with _clients_lock:
+        if (host, port) not in _bulk_controllers:
+            _bulk_controllers[(host, port)] = BulkController()
+
+        return _bulk_controllers[(host, port)]
+
 
-    es = Elasticsearch(hosts=[{'host': host, 'port': port}],
-                       http_auth=(os.environ['ALHENA_ES_USER'],
-                                  os.environ['ALHENA_ES_PASSWORD']),
-                       scheme='https',
-                       timeout=300,
-                       verify_certs=False)
+def close_es():
+    with _clients_lock:
+        for es in _clients.values():
+            es.transport.close()
+        _clients.clear()
+        _known_indices.clear()
 
-    return es
+
+def clear_index_cache():
+    with _clients_lock:
+        _known_indices.clear()
+
+
+def index_exists(index, host, port):
+    known_indices = _known_indices.setdefault((host, port), set())
+    if index in known_indices:
+        return True
+
+    es = initialize_es(host, port)
+    if es.indices.exists(index):
+        known_indices.add(index)
+        return True
+
+    return False
+
+
+def create_index(index, host, port, mapping=DEFAULT_MAPPING):
+    if index_exists(index, host, port):
+        return
+
+    es = initialize_es(host, port)
+
+    logger.info(f'No index found - creating index named {index}')
+    try:
+        es.indices.create(index=index, body=mapping)
+    except RequestError as err:
+        # another loader thread got there first
+        if err.error != 'resource_already_exists_exception':
+            raise
+
+    _known_indices.setdefault((host, port), set()).add(index)
+
+
+def forget_index(index, host, port):
+    known_indices = _known_indices.setdefault((host, port), set())
+    for known_index in fnmatch.filter(list(known_indices), index):
+        known_indices.discard(known_index)
 
 
 def initialize_indices(host, port):
@@ -65,6 +401,121 @@ def initialize_indices(host, port):
     )
 
 
+def get_index_name(dashboard_id, data_type, version=None):
+    """Name of a dashboard's index, or of one of its versions
+
+    Data is loaded into versioned indices (<dashboard_id>_<data_type>_v<version>)
+    and the dashboard reads them through an alias with the unversioned name
+    """
+    index_name = f"{dashboard_id.lower()}_{data_type}"
+    if version is None:
+        return index_name
+
+    return f"{index_name}_v{version}"
+
+
+def get_index_versions(index_name, host, port):
+    es = initialize_es(host, port)
+
+    versions = []
+    for versioned_index in es.indices.get(index=f"{index_name}_v*").keys():
+        match = re.fullmatch(re.escape(index_name) + r"_v(\d+)", versioned_index)
+        if match:
+            versions.append(int(match.group(1)))
+
+    return sorted(versions)
+
+
+def get_next_index_version(dashboard_id, host, port):
+    versions = [version for data_type in constants.DATA_TYPES
+                for version in get_index_versions(get_index_name(dashboard_id, data_type), host, port)]
+
+    return max(versions, default=0) + 1
+
+
+def swap_index_version(dashboard_id, version, host, port):
+    """Point every alias of the dashboard at the given version in one atomic update, then delete older versions"""
+    es = initialize_es(host, port)
+
+    actions = []
+    for data_type in constants.DATA_TYPES:
+        alias = get_index_name(dashboard_id, data_type)
+        versioned_index = get_index_name(dashboard_id, data_type, version)
+
+        if es.indices.exists_alias(name=alias):
+            for index in es.indices.get_alias(name=alias).keys():
+                actions.append({"remove": {"index": index, "alias": alias}})
+        elif es.indices.exists(alias):
+            # loaded before indices were versioned
+            actions.append({"remove_index": {"index": alias}})
+            forget_index(alias, host, port)
+
+        actions.append({"add": {"index": versioned_index, "alias": alias}})
+
+    logger.info(f'Switching {dashboard_id} to version {version}')
+    es.indices.update_aliases(body={"actions": actions})
+
+    for data_type in constants.DATA_TYPES:
+        alias = get_index_name(dashboard_id, data_type)
+        for old_version in get_index_versions(alias, host, port):
+            if old_version != version:
+                logger.info(f'Deleting {alias} version {old_version}')
+                old_index = get_index_name(dashboard_id, data_type, old_version)
+                delete_index(old_index, host=host, port=port)
+                delete_fingerprints(old_index, host, port)
+
+
+def get_current_index_version(dashboard_id, host, port):
+    """Version the dashboard's aliases point at, or None if it has no versioned indices"""
+    es = initialize_es(host, port)
+
+    alias = get_index_name(dashboard_id, constants.DATA_TYPES[0])
+    if not es.indices.exists_alias(name=alias):
+        return None
+
+    for index in es.indices.get_alias(name=alias).keys():
+        match = re.fullmatch(re.escape(alias) + r"_v(\d+)", index)
+        if match:
+            return int(match.group(1))
+
+    return None
+
+
+@contextlib.contextmanager
+def fast_ingest(indices, host, port, force_merge=False):
+    """Load into the given {index name: mapping} with ingest settings, restoring the previous settings on exit"""
+    es = initialize_es(host, port)
+
+    previous_settings = {}
+    try:
+        for index, mapping in indices.items():
+            create_index(index, host, port, mapping=mapping)
+
+            response = es.indices.get_settings(
+                index=index, name=list(INGEST_SETTINGS.keys()), flat_settings=True)
+            settings = list(response.values())[0]["settings"]
+
+            # settings left at their default are restored by resetting to null
+            previous_settings[index] = {
+                name: settings.get(name) for name in INGEST_SETTINGS}
+
+            logger.info(f'Applying ingest settings to {index}')
+            es.indices.put_settings(index=index, body=INGEST_SETTINGS)
+
+        yield
+
+    finally:
+        for index, settings in previous_settings.items():
+            logger.info(f'Restoring settings on {index}')
+            es.indices.put_settings(index=index, body=settings)
+            es.indices.refresh(index=index)
+
+    if force_merge:
+        for index in indices:
+            logger.info(f'Force merging {index}')
+            es.indices.forcemerge(index=index, max_num_segments=1)
+
+
 ####################
 
 def load_dashboard_record(record, dashboard_id, host, port):
@@ -74,28 +525,9 @@ def load_dashboard_record(record, dashboard_id, host, port):
     print(resp)
     print(constants.DASHBOARD_ENTRY_INDEX, dashboard_id, record)
 
-def load_records(records, index_name, host, port, mapping=DEFAULT_MAPPING):
-    es = initialize_es(host, port)
-
-    if not es.indices.exists(index_name):
-        logger.info(f'No index found - creating index named {index_name}')
-        es.indices.create(
-            index=index_name,
-            body=mapping
-        )
-
-    for success, info in helpers.parallel_bulk(es, records, index=index_name):
-        if not success:
-            #   logging.error(info)
-            logger.info(info)
-            logger.info('Doc failed in parallel loading')
-
-
 def load_record(record, record_id, index, host, port, mapping=DEFAULT_MAPPING):
+    create_index(index, host, port, mapping=mapping)
     es = initialize_es(host, port)
-    if not es.indices.exists(index):
-        logger.info(f'No index found - creating index named {index}')
-        es.indices.create(index=index, body=mapping)
 
     logger.info(f'Loading record')
     resp = es.index(index=index, id=record_id, body=record)
@@ -107,33 +539,97 @@ def load_record(record, record_id, index, host, port, mapping=DEFAULT_MAPPING):
 ###########
 
 
-def clean_analysis(dashboard_id, host, port, projects=[]):
+def clean_analysis(dashboard_id, host, port, projects=[], roles=None):
     logger.info("====================== " + dashboard_id)
     logger.info("Cleaning records")
 
     for data_type in constants.DATA_TYPES:
         logger.info(f"Deleting {data_type} records")
-        delete_index(f"{dashboard_id.lower()}_{data_type}",
+        # versions first, which also removes the alias
+        delete_index(get_index_name(dashboard_id, data_type) + "_v*",
+                     host=host, port=port)
+        delete_index(get_index_name(dashboard_id, data_type),
                      host=host, port=port)
 
     logger.info("DELETE DASHBOARD_ENTRY")
     delete_records(constants.DASHBOARD_ENTRY_INDEX,
                    dashboard_id, host=host, port=port)
+    delete_records(constants.FINGERPRINT_INDEX,
+                   dashboard_id, host=host, port=port)
 
     logger.info("Removing from projects")
-    remove_dashboard_from_projects(dashboard_id, host, port, projects)
+    remove_dashboard_from_projects(
+        dashboard_id, host, port, projects, roles=roles)
+
+
+def get_fingerprints(index_name, source, host, port):
+    es = initialize_es(host, port)
+
+    if not index_exists(constants.FINGERPRINT_INDEX, host, port):
+        return None
+
+    try:
+        response = es.get(index=constants.FINGERPRINT_INDEX,
+                          id=f"{index_name}:{source}")
+        return response["_source"]["fingerprints"]
+    except NotFoundError:
+        return None
+
+
+def get_dashboard_bins_layout(dashboard_id, host, port):
+    """Bins layout on the dashboard's analyses record, or None if it has no record"""
+    es = initialize_es(host, port)
+
+    try:
+        response = es.get(index=constants.DASHBOARD_ENTRY_INDEX, id=dashboard_id)
+    except NotFoundError:
+        return None
+
+    # records from before the packed layout are of the bin layout
+    return response["_source"].get("bins_layout", constants.BINS_LAYOUT_BIN)
+
+
+def save_fingerprints(dashboard_id, index_name, source, fingerprints, host, port):
+    create_index(constants.FINGERPRINT_INDEX, host,
+                 port, mapping=FINGERPRINT_MAPPING)
+    es = initialize_es(host, port)
+
+    es.index(index=constants.FINGERPRINT_INDEX, id=f"{index_name}:{source}", body={
+        "dashboard_id": dashboard_id,
+        "index": index_name,
+        "source": source,
+        "fingerprints": fingerprints
+    })
+
+
+def delete_fingerprints(index_name, host, port):
+    es = initialize_es(host, port)
+
+    if index_exists(constants.FINGERPRINT_INDEX, host, port):
+        es.delete_by_query(index=constants.FINGERPRINT_INDEX, body={
+            "query": {"term": {"index": index_name}}}, refresh=True)
+
+
+def delete_cells(index_name, cell_ids, host, port, batch_size=10000):
+    es = initialize_es(host, port)
+
+    for batch_start_idx in range(0, len(cell_ids), batch_size):
+        batch = cell_ids[batch_start_idx:batch_start_idx + batch_size]
+        es.delete_by_query(index=index_name, body={
+            "query": {"terms": {"cell_id": batch}}}, conflicts="proceed", refresh=True)
 
 
 def delete_index(index, host="localhost", port=9200):
     es = initialize_es(host, port)
     if es.indices.exists(index):
         es.indices.delete(index=index, ignore=[400, 404])
+    forget_index(index, host, port)
 
 
 def delete_records(index, filter_value, host="localhost", port=9200):
     es = initialize_es(host, port)
 
-    if es.indices.exists(index):
+    if index_exists(index, host, port):
         query = fill_base_query(filter_value)
         resp = es.delete_by_query(index=index, body=query, refresh=True)
 
@@ -165,13 +661,7 @@ def fill_base_query(value):
 
 
 def get_projects(host, port):
-    es = initialize_es(host, port)
-
-    response = es.security.get_role()
-    projects = [response_key[:-len("_dashboardReader")] for response_key in response.keys(
-    ) if response_key.endswith("_dashboardReader")]
-
-    return projects
+    return get_role_manager(host, port).get_projects()
 
 
 def is_project_exist(project, host, port):
@@ -202,79 +692,28 @@ def add_project(project_name, dashboards, host, port):
     logger.info(f'Added new project: {project_name} ')
 
 
-def add_dashboard_to_projects(dashboard_id, projects, host, port):
-
-    es = initialize_es(host, port)
-
-    for project in projects:
-
-        logger.info(f'Adding {dashboard_id} to {project} list')
-        project_role_name = f'{project}_dashboardReader'
-
-        project_role = es.security.get_role(name=project_role_name)
-        project_indices = list(
-            project_role[project_role_name]["indices"][0]["names"])
+def get_role_manager(host, port, dry_run=False):
+    return RoleManager(initialize_es(host, port), dry_run=dry_run)
 
-        if dashboard_id in project_indices:
-            continue
-        else:
-            project_indices.append(dashboard_id)
-            es.security.put_role(name=project_role_name, body={
-                'indices': [{
-                    'names': project_indices,
-                    'privileges': ["read"]
-                }]
-            }
-            )
-
-
-def remove_dashboard_from_projects(dashboard_id, host, port, projects):
-    es = initialize_es(host, port)
-
-    if len(projects) > 0:
-        projects = [
-            f"{proj}_dashboardReader" for proj in projects]
 
-        logger.info(f'Removing {dashboard_id} from {len(projects)} projects')
+def add_dashboard_to_projects(dashboard_id, projects, host, port, roles=None):
+    """Add the dashboard to the projects, written on roles.flush() when a shared RoleManager is given"""
+    role_manager = roles if roles is not None else get_role_manager(host, port)
 
-        for project in projects:
-            response = es.security.get_role(name=project)
+    logger.info(f'Adding {dashboard_id} to {list(projects)}')
+    role_manager.add_dashboard(dashboard_id, projects)
 
-            project_data = response[project]
-            project_indices = list(project_data["indices"][0]["names"])
+    if roles is None:
+        role_manager.flush()
 
-            if dashboard_id in project_indices:
-                logger.info(f'Removing {dashboard_id} from {project}')
 
-                project_indices.remove(dashboard_id)
+def remove_dashboard_from_projects(dashboard_id, host, port, projects, roles=None):
+    """Remove the dashboard from the projects, or from all projects if none are given"""
+    role_manager = roles if roles is not None else get_role_manager(host, port)
 
-                es.security.put_role(name=project, body={
-                    'indices': [{
-                        'names': project_indices,
-                        'privileges': ["read"]
-                    }]
-                }
-                )
-    else:
-        response = es.security.get_role()
-        projects = [response_key for response_key in response.keys(
-        ) if response_key.endswith("_dashboardReader")]
+    logger.info(
+        f'Removing {dashboard_id} from {len(projects) if len(projects) > 0 else "all"} projects')
+    role_manager.remove_dashboard(dashboard_id, projects)
 
-        logger.info(f'Removing {dashboard_id} from {len(projects)} projects')
-
-        for project in projects:
-            project_data = response[project]
-            project_indices = list(project_data["indices"][0]["names"])
-
-            if dashboard_id in project_indices:
-                logger.info(f'Removing {dashboard_id} from {project}')
-
-                project_indices.remove(dashboard_id)
-
-                es.security.put_role(name=project, body={
-                    'indices': [{
-                        'names': project_indices,
-                        'privileges': ["read"]
-                    }]
-                }
-                )
+    if roles is None:
+        role_manager.flush()
@@ -0,0 +1,238 @@
+import os
+import json
+import gzip
+import time
+import datetime
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from alhena.serializer import bulk_lines
+from alhena.checkpoint import Checkpoint
+from alhena.elasticsearch import get_bulk_client, get_bulk_controller, create_index, get_next_index_version, swap_index_version, load_dashboard_record, add_dashboard_to_projects, fast_ingest as _fast_ingest, clear_index_cache, MAPPING_VERSION
+
+import logging
+logger = logging.getLogger('alhena_loading')
+
+
+EXPORT_OPTIONS = {
+    # uncompressed bytes per part file, parts are the unit of replay parallelism and resume
+    "part_bytes": 32 * 1024 * 1024,
+    "compresslevel": 3
+}
+
+MANIFEST_FILENAME = "manifest.json"
+ANALYSES_FILENAME = "analyses.json"
+
+
+class BulkExport(object):
+    """Writes a dashboard's bulk requests to gzipped NDJSON part files instead of sending them
+
+    Action lines have no _index, the versioned index is chosen when the
+    files are replayed into a cluster
+    """
+
+    def __init__(self, directory, dashboard_id, part_bytes=None):
+        self.dashboard_id = dashboard_id
+        self.directory = os.path.join(directory, dashboard_id)
+        self.part_bytes = part_bytes or EXPORT_OPTIONS["part_bytes"]
+        self.indices = {}
+        self._parts = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def add_index(self, index_name, mapping):
+        with self._lock:
+            if index_name not in self.indices:
+                self.indices[index_name] = {"mapping": mapping, "files": []}
+                os.makedirs(os.path.join(
+                    self.directory, index_name), exist_ok=True)
+
+    def write(self, records, index_name, source=""):
+        """Append records to the current part file of index_name and source, returning the number written"""
+        key = (index_name, source)
+        num_records = 0
+
+        for record in records:
+            action = {}
+            if "_id" in record:
+                action["_id"] = record.pop("_id")
+            lines = bulk_lines({"index": action}, record)
+
+            part = self._parts.get(key)
+            if part is None:
+                part = self._open_part(index_name, source)
+
+            part["file"].write(lines)
+            part["documents"] += 1
+            part["bytes"] += len(lines)
+            num_records += 1
+
+            if part["bytes"] >= self.part_bytes:
+                self._close_part(key)
+
+        return num_records
+
+    def write_dashboard_entry(self, record):
+        _write_json(os.path.join(self.directory, ANALYSES_FILENAME), record)
+
+    def finish(self, projects):
+        for key in list(self._parts.keys()):
+            self._close_part(key)
+
+        manifest = {
+            "dashboard_id": self.dashboard_id,
+            "projects": list(projects),
+            "mapping_version": MAPPING_VERSION,
+            "created": datetime.datetime.now().isoformat(),
+            "analyses": ANALYSES_FILENAME,
+            "indices": self.indices
+        }
+        _write_json(os.path.join(self.directory, MANIFEST_FILENAME), manifest)
+
+        num_files = sum(len(index["files"]) for index in self.indices.values())
+        logger.info(
+            f'Exported {self.dashboard_id} to {num_files} files in {self.directory}')
+
+    def _open_part(self, index_name, source):
+        prefix = f"{source.replace(os.sep, '_')}-" if source else ""
+        with self._lock:
+            part_idx = len(self.indices[index_name]["files"]) + \
+                len([key for key in self._parts if key[0] == index_name])
+            path = os.path.join(
+                index_name, f"{prefix}{part_idx:05d}.ndjson.gz")
+
+            part = {
+                "path": path,
+                "file": gzip.open(os.path.join(self.directory, path), "wb",
+                                  compresslevel=EXPORT_OPTIONS["compresslevel"]),
+                "documents": 0,
+                "bytes": 0
+            }
+            self._parts[(index_name, source)] = part
+
+        return part
+
+    def _close_part(self, key):
+        with self._lock:
+            part = self._parts.pop(key)
+        part["file"].close()
+        with self._lock:
+            self.indices[key[0]]["files"].append({
+                "path": part["path"],
+                "documents": part["documents"],
+                "bytes": part["bytes"]
+            })
+
+
+def read_export_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_FILENAME)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def read_part_lines(path, progress=None):
+    """Yield the encoded action and document line pairs of a part file"""
+    with gzip.open(path, "rb") as part_file:
+        for action in part_file:
+            lines = action + next(part_file)
+            if progress is not None:
+                progress.add(len(lines))
+            yield lines
+
+
+class ReplayProgress(object):
+    """Logs bytes replayed at most every interval seconds"""
+
+    def __init__(self, total_bytes, interval=10):
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.num_bytes = 0
+        self.started = time.time()
+        self._logged = self.started
+        self._lock = threading.Lock()
+
+    def add(self, num_bytes):
+        with self._lock:
+            self.num_bytes += num_bytes
+            now = time.time()
+            if now - self._logged < self.interval:
+                return
+            self._logged = now
+
+        self.log()
+
+    def log(self):
+        seconds = max(time.time() - self.started, 1e-6)
+        logger.info(
+            f'Replayed {self.num_bytes / 1e6:.0f} / {self.total_bytes / 1e6:.0f} MB ({round(self.num_bytes * 100 / max(self.total_bytes, 1), 2)}%), {self.num_bytes / 1e6 / seconds:.1f} MB/s')
+
+
+def replay_bulk(directory, host, port, workers=4, resume=False, fast_ingest=False, force_merge=False):
+    """Index an exported dashboard into a new version of its indices, then switch its aliases to it"""
+    manifest = read_export_manifest(directory)
+    dashboard_id = manifest["dashboard_id"]
+    logger.info("====================== " + dashboard_id)
+
+    if manifest["mapping_version"] != MAPPING_VERSION:
+        logger.info(
+            f'{directory} was exported with mapping version {manifest["mapping_version"]}, loader is at {MAPPING_VERSION}')
+
+    clear_index_cache()
+    checkpoint = Checkpoint(dashboard_id, resume=resume)
+    if checkpoint.version is None:
+        checkpoint.set_version(
+            get_next_index_version(dashboard_id, host, port))
+    logger.info(f"Replaying {dashboard_id} into version {checkpoint.version}")
+
+    indices = {f"{index_name}_v{checkpoint.version}": index for index_name,
+               index in manifest["indices"].items()}
+
+    parts = [(versioned_name, part) for versioned_name, index in indices.items()
+             for part in index["files"]
+             if not checkpoint.is_done(f'replay:{versioned_name}:{part["path"]}')]
+    progress = ReplayProgress(sum(part["bytes"] for _, part in parts))
+    logger.info(
+        f'Replaying {len(parts)} files, {progress.total_bytes / 1e6:.0f} MB')
+
+    ingest_settings = _fast_ingest({versioned_name: index["mapping"] for versioned_name, index in indices.items()},
+                                   host, port, force_merge=force_merge) if fast_ingest else contextlib.nullcontext()
+
+    with ingest_settings:
+        # created even when there is no data, so the alias can point at it
+        for versioned_name, index in indices.items():
+            create_index(versioned_name, host, port, mapping=index["mapping"])
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(replay_part, directory, versioned_name, part, host, port, checkpoint, progress)
+                       for versioned_name, part in parts]
+            num_failed = sum(future.result() for future in as_completed(futures))
+
+    progress.log()
+    assert num_failed == 0, f'{num_failed} documents failed, run again with --resume to retry their files'
+
+    swap_index_version(dashboard_id, checkpoint.version, host, port)
+
+    with open(os.path.join(directory, manifest["analyses"])) as analyses_file:
+        load_dashboard_record(json.load(analyses_file), dashboard_id, host, port)
+    add_dashboard_to_projects(dashboard_id, manifest["projects"], host, port)
+    checkpoint.finish()
+    logger.info("Done")
+
+
+def replay_part(directory, index_name, part, host, port, checkpoint, progress):
+    es = get_bulk_client(host, port)
+    num_success, num_failed = get_bulk_controller(host, port).bulk_lines(
+        es, read_part_lines(os.path.join(directory, part["path"]), progress), index_name)
+
+    if num_failed == 0:
+        checkpoint.mark_done(
+            f'replay:{index_name}:{part["path"]}', num_success)
+    return num_failed
+
+
+def _write_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as output:
+        json.dump(data, output)
+    os.replace(temp_path, path)
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import resource
+import datetime
+import threading
+import contextlib
+import numpy as np
+
+import logging
+logger = logging.getLogger('alhena_loading')
+
+
+REPORT_OPTIONS = {
+    "report": None,
+    "prometheus_textfile": None
+}
+
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+class StageMetrics(object):
+    """Totals of one stage of loading one index"""
+
+    def __init__(self, stage, index):
+        self.stage = stage
+        self.index = index
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.docs = 0
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.latencies = []
+        self.peak_rss = 0
+
+    def to_dict(self):
+        record = {
+            "stage": self.stage,
+            "index": self.index,
+            "seconds": round(self.seconds, 3),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "peak_rss_bytes": self.peak_rss
+        }
+
+        if self.requests > 0:
+            record.update({
+                "docs": self.docs,
+                "docs_per_sec": round(self.docs / self.seconds, 1) if self.seconds > 0 else None,
+                "mb_per_sec": round(self.bytes / 1e6 / self.seconds, 2) if self.seconds > 0 else None,
+                "requests": self.requests,
+                "rejected_docs": self.rejected,
+                "failed_docs": self.failed,
+                **{f"latency_p{percentile}": round(float(value), 3)
+                   for percentile, value in zip(LATENCY_PERCENTILES, np.percentile(self.latencies, LATENCY_PERCENTILES))},
+                "latency_max": round(max(self.latencies), 3)
+            })
+
+        return record
+
+
+class QueueMetrics(object):
+    """Depth of the bounded queue in front of a pipeline stage, and time spent waiting on it
+
+    A stage whose input queue is mostly full, with producers waiting to put,
+    is the bottleneck. A stage whose consumers wait to get is starved by the
+    stages before it
+    """
+
+    def __init__(self, stage, index, capacity):
+        self.stage = stage
+        self.index = index
+        self.capacity = capacity
+        self.samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "index": self.index,
+            "capacity": self.capacity,
+            "items": self.samples,
+            "mean_depth": round(self.depth_total / self.samples, 2) if self.samples > 0 else 0,
+            "max_depth": self.max_depth,
+            "put_wait_seconds": round(self.put_wait, 3),
+            "get_wait_seconds": round(self.get_wait, 3)
+        }
+
+
+class LoadMetrics(object):
+    """Metrics of everything loaded by this process, safe to update from several threads"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.queues = {}
+        self._lock = threading.Lock()
+
+    def _get_stage(self, stage, index):
+        key = (stage, index)
+        if key not in self.stages:
+            self.stages[key] = StageMetrics(stage, index)
+        return self.stages[key]
+
+    def record_stage(self, stage, index, seconds, rows=0, bytes=0):
+        peak_rss = get_peak_rss()
+        with self._lock:
+            metrics = self._get_stage(stage, index)
+            metrics.seconds += seconds
+            metrics.rows += rows
+            metrics.bytes += bytes
+            metrics.peak_rss = max(metrics.peak_rss, peak_rss)
+
+    def record_bulk(self, index, docs, bytes, latency, rejected=0, failed=0):
+        with self._lock:
+            metrics = self._get_stage("load", index)
+            metrics.docs += docs
+            metrics.bytes += bytes
+            metrics.requests += 1
+            metrics.rejected += rejected
+            metrics.failed += failed
+            metrics.latencies.append(latency)
+
+    def record_queue(self, stage, index, capacity, depth=None, put_wait=0.0, get_wait=0.0):
+        with self._lock:
+            key = (stage, index)
+            if key not in self.queues:
+                self.queues[key] = QueueMetrics(stage, index, capacity)
+            metrics = self.queues[key]
+
+            if depth is not None:
+                metrics.samples += 1
+                metrics.depth_total += depth
+                metrics.max_depth = max(metrics.max_depth, depth)
+            metrics.put_wait += put_wait
+            metrics.get_wait += get_wait
+
+    def get_report(self):
+        with self._lock:
+            stages = [metrics.to_dict() for metrics in self.stages.values()]
+            queues = [metrics.to_dict() for metrics in self.queues.values()]
+
+        return {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(),
+            "seconds": round(time.time() - self.started, 3),
+            "peak_rss_bytes": get_peak_rss(),
+            "stages": stages,
+            "queues": queues
+        }
+
+
+_metrics = LoadMetrics()
+
+
+def configure_instrumentation(report=None, prometheus_textfile=None):
+    """Paths the run report and Prometheus textfile are written to by write_reports"""
+    REPORT_OPTIONS["report"] = report
+    REPORT_OPTIONS["prometheus_textfile"] = prometheus_textfile
+
+
+def reset_metrics():
+    global _metrics
+    _metrics = LoadMetrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def get_peak_rss():
+    """Peak resident memory of the process in bytes. Linux reports kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def record_stage(stage, index, seconds, rows=0, bytes=0):
+    _metrics.record_stage(stage, index, seconds, rows=rows, bytes=bytes)
+
+
+def record_bulk(index, docs, bytes, latency, rejected=0, failed=0):
+    _metrics.record_bulk(index, docs, bytes, latency,
+                         rejected=rejected, failed=failed)
+
+
+def record_queue(stage, index, capacity, depth=None, put_wait=0.0, get_wait=0.0):
+    """Record a put on (with the depth after it) or a get from the queue in front of a pipeline stage"""
+    _metrics.record_queue(stage, index, capacity, depth=depth,
+                          put_wait=put_wait, get_wait=get_wait)
+
+
+@contextlib.contextmanager
+def timed_stage(stage, index=None):
+    """Time a stage, the rows and bytes it handled can be set on the yielded dict"""
+    counts = {"rows": 0, "bytes": 0}
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        record_stage(stage, index, time.perf_counter() -
+                     start, rows=counts["rows"], bytes=counts["bytes"])
+
+
+def write_reports(**labels):
+    """Write the configured report and Prometheus textfile, labels are added to both"""
+    if REPORT_OPTIONS["report"] is None and REPORT_OPTIONS["prometheus_textfile"] is None:
+        return
+
+    report = {**labels, **_metrics.get_report()}
+
+    if REPORT_OPTIONS["report"] is not None:
+        _write_atomic(REPORT_OPTIONS["report"], json.dumps(report, indent=2))
+        logger.info(f'Wrote load report to {REPORT_OPTIONS["report"]}')
+
+    if REPORT_OPTIONS["prometheus_textfile"] is not None:
+        _write_atomic(REPORT_OPTIONS["prometheus_textfile"],
+                      format_prometheus(report, labels))
+        logger.info(
+            f'Wrote Prometheus metrics to {REPORT_OPTIONS["prometheus_textfile"]}')
+
+
+PROMETHEUS_STAGE_METRICS = [
+    ("seconds", "alhena_stage_seconds", "Wall time spent in the stage"),
+    ("rows", "alhena_stage_rows", "Rows handled by the stage"),
+    ("bytes", "alhena_stage_bytes", "Bytes handled by the stage, bulk request bytes for load"),
+    ("docs_per_sec", "alhena_load_docs_per_second", "Documents indexed per second"),
+    ("rejected_docs", "alhena_load_rejected_docs", "Documents rejected by the cluster and retried"),
+    ("failed_docs", "alhena_load_failed_docs", "Documents that could not be indexed"),
+    ("peak_rss_bytes", "alhena_stage_peak_rss_bytes", "Peak resident memory of the loader by the end of the stage")
+]
+
+PROMETHEUS_QUEUE_METRICS = [
+    ("mean_depth", "alhena_queue_mean_depth", "Mean items waiting in front of a pipeline stage"),
+    ("max_depth", "alhena_queue_max_depth", "Most items waiting in front of a pipeline stage"),
+    ("put_wait_seconds", "alhena_queue_put_wait_seconds", "Time the previous stage waited for room in the queue"),
+    ("get_wait_seconds", "alhena_queue_get_wait_seconds", "Time the stage waited for items from the queue")
+]
+
+
+def format_prometheus(report, labels={}):
+    """Prometheus text exposition of a run report, for the node exporter textfile collector"""
+    run_labels = _format_labels(labels)
+    lines = [
+        "# HELP alhena_run_seconds Wall time of the loader run",
+        "# TYPE alhena_run_seconds gauge",
+        f"alhena_run_seconds{run_labels} {report['seconds']}",
+        "# HELP alhena_run_peak_rss_bytes Peak resident memory of the loader run",
+        "# TYPE alhena_run_peak_rss_bytes gauge",
+        f"alhena_run_peak_rss_bytes{run_labels} {report['peak_rss_bytes']}",
+        "# HELP alhena_run_timestamp_seconds When the loader run finished",
+        "# TYPE alhena_run_timestamp_seconds gauge",
+        f"alhena_run_timestamp_seconds{run_labels} {int(time.time())}"
+    ]
+
+    for field, name, description in PROMETHEUS_STAGE_METRICS:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        for stage in report["stages"]:
+            if stage.get(field) is not None:
+                stage_labels = _format_labels(
+                    {**labels, "stage": stage["stage"], "index": stage["index"] or ""})
+                lines.append(f"{name}{stage_labels} {stage[field]}")
+
+    lines += ["# HELP alhena_bulk_latency_seconds Bulk request latency",
+              "# TYPE alhena_bulk_latency_seconds gauge"]
+    for stage in report["stages"]:
+        for percentile in LATENCY_PERCENTILES:
+            if f"latency_p{percentile}" in stage:
+                stage_labels = _format_labels(
+                    {**labels, "index": stage["index"], "quantile": str(percentile / 100)})
+                lines.append(
+                    f"alhena_bulk_latency_seconds{stage_labels} {stage[f'latency_p{percentile}']}")
+
+    for field, name, description in PROMETHEUS_QUEUE_METRICS:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        for queue in report.get("queues", []):
+            queue_labels = _format_labels(
+                {**labels, "stage": queue["stage"], "index": queue["index"] or ""})
+            lines.append(f"{name}{queue_labels} {queue[field]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _write_atomic(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as output:
+        output.write(content)
+    os.replace(temp_path, path)
@@ -8,6 +8,8 @@ import scipy.stats
 import pandas as pd
 import numpy as np
 import alhena.constants as constants
+from alhena.cache import get_cached_data, get_isabl_key
+from alhena.instrumentation import timed_stage
 import isabl_cli as ii
 from scgenome.db.qc_from_files import get_qc_data_from_filenames
 
@@ -28,10 +30,18 @@ def get_scgenome_isabl_data(target_aliquot):
 
     #current = [alignment.pk, hmmcopy.pk, annotation.pk]
 
+    with timed_stage("parse", f'isabl {target_aliquot}') as stage:
+        data = get_cached_data(get_isabl_key(alignment.pk, hmmcopy.pk, annotation.pk), f'isabl {target_aliquot}',
+                               lambda: read_scgenome_isabl_data(alignment.pk, hmmcopy.pk, annotation.pk))
+        stage["rows"] = sum(table.shape[0] for table in data.values())
+    return data
+
+
+def read_scgenome_isabl_data(alignment_pk, hmmcopy_pk, annotation_pk):
     #retrieve paths
-    annotation_metrics = get_annotation_path(annotation.pk)
-    hmmcopy_metrics,hmmcopy_reads,hmmcopy_segs = get_hmmcopy_path(hmmcopy.pk)
-    alignment_metrics, gc_metrics = get_alignment_path(alignment.pk)
+    annotation_metrics = get_annotation_path(annotation_pk)
+    hmmcopy_metrics,hmmcopy_reads,hmmcopy_segs = get_hmmcopy_path(hmmcopy_pk)
+    alignment_metrics, gc_metrics = get_alignment_path(alignment_pk)
 
     results = get_qc_data_from_filenames(
         [annotation_metrics], [hmmcopy_reads], [hmmcopy_segs],
@@ -0,0 +1,186 @@
+import time
+import queue
+import threading
+
+from alhena.instrumentation import record_queue
+
+import logging
+logger = logging.getLogger('alhena_loading')
+
+
+PIPELINE_OPTIONS = {
+    # rows per item passed between stages
+    "slice_rows": 10000,
+    # items waiting in front of each stage, bounds the memory of a load
+    "queue_size": 4,
+    "build_workers": 2,
+    "serialize_workers": 2
+}
+
+# how often blocked workers check whether another stage failed
+POLL_SECONDS = 0.1
+
+
+def configure_pipeline(slice_rows=None, queue_size=None, build_workers=None, serialize_workers=None):
+    for option, value in [("slice_rows", slice_rows), ("queue_size", queue_size), ("build_workers", build_workers),
+                          ("serialize_workers", serialize_workers)]:
+        if value is not None:
+            assert value > 0, f'{option} must be positive'
+            PIPELINE_OPTIONS[option] = value
+
+
+class _Done(object):
+    """Put once per worker of the next stage when a stage has finished"""
+
+
+class StageQueue(object):
+    """Bounded queue in front of a stage, recording its depth and waits in the load metrics"""
+
+    def __init__(self, stage, index, capacity, stopped):
+        self.stage = stage
+        self.index = index
+        self.capacity = capacity
+        self._queue = queue.Queue(maxsize=capacity)
+        self._stopped = stopped
+
+    def put(self, item):
+        """Put item, returning False instead if the pipeline stopped"""
+        start = time.perf_counter()
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+            except queue.Full:
+                continue
+
+            if not isinstance(item, _Done):
+                record_queue(self.stage, self.index, self.capacity, depth=self._queue.qsize(),
+                             put_wait=time.perf_counter() - start)
+            return True
+
+        return False
+
+    def get(self):
+        """Next item, or None if the pipeline stopped"""
+        start = time.perf_counter()
+        while not self._stopped.is_set():
+            try:
+                item = self._queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+            record_queue(self.stage, self.index, self.capacity,
+                         get_wait=time.perf_counter() - start)
+            return item
+
+        return None
+
+
+class Pipeline(object):
+    """Stages on their own worker threads, connected by bounded queues
+
+    stages is a list of (name, function, number of workers). Items from run's
+    iterable go through each function in turn, the result of one stage being
+    the input of the next. A full queue blocks the stage before it, so a slow
+    stage holds back the others instead of items piling up in memory. The
+    first error in any stage stops the pipeline and is raised from run
+
+    sink is an optional (name, function) taking, on one thread, an iterator
+    over the results of the last stage, for consumers that batch items
+    themselves rather than handling them one at a time
+    """
+
+    def __init__(self, index, stages, queue_size=None, sink=None):
+        self.index = index
+        self.stages = stages
+        self.sink = sink
+        self.queue_size = queue_size or PIPELINE_OPTIONS["queue_size"]
+        self._stopped = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        # the sink runs as a stage of one worker
+        stages = self.stages if self.sink is None else [*self.stages, (*self.sink, 1)]
+        queues = [StageQueue(name, self.index, self.queue_size, self._stopped)
+                  for name, _, _ in stages]
+        threads = []
+        for stage_idx, (name, func, workers) in enumerate(self.stages):
+            # without a sink, the last stage's results are dropped
+            is_last = stage_idx == len(stages) - 1
+            output_queue = None if is_last else queues[stage_idx + 1]
+            next_workers = 0 if is_last else stages[stage_idx + 1][2]
+
+            remaining = [workers]
+            for worker_idx in range(workers):
+                thread = threading.Thread(target=self._work, name=f"{name}-{worker_idx}",
+                                          args=(func, queues[stage_idx], output_queue, remaining, next_workers), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        if self.sink is not None:
+            name, func = self.sink
+            thread = threading.Thread(target=self._drain, name=name,
+                                      args=(func, queues[-1]), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for item in items:
+                if not queues[0].put(item):
+                    break
+        except Exception as err:
+            self._fail(err)
+
+        for _ in range(self.stages[0][2]):
+            queues[0].put(_Done())
+
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _work(self, func, input_queue, output_queue, remaining, next_workers):
+        try:
+            while True:
+                item = input_queue.get()
+                if item is None:
+                    return
+                if isinstance(item, _Done):
+                    break
+
+                result = func(item)
+                if output_queue is not None and not output_queue.put(result):
+                    return
+
+            # the last worker of a stage to finish tells the next stage
+            with self._lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished and output_queue is not None:
+                for _ in range(next_workers):
+                    output_queue.put(_Done())
+
+        except Exception as err:
+            self._fail(err)
+
+    def _drain(self, func, input_queue):
+        def items():
+            while True:
+                item = input_queue.get()
+                if item is None or isinstance(item, _Done):
+                    return
+                yield item
+
+        try:
+            func(items())
+        except Exception as err:
+            self._fail(err)
+
+    def _fail(self, err):
+        with self._lock:
+            if self._error is None:
+                logger.exception(
+                    f'{self.index}: pipeline stage failed, stopping')
+                self._error = err
+        self._stopped.set()
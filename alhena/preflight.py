@@ -0,0 +1,108 @@
+import threading
+
+from elasticsearch.exceptions import NotFoundError
+
+import alhena.constants as constants
+from alhena.elasticsearch import initialize_es, get_role_manager
+
+import logging
+logger = logging.getLogger('alhena_loading')
+
+
+# terms per query, below the default index.max_result_window of 10000
+PREFLIGHT_BATCH_SIZE = 10000
+
+_preflights = {}
+_preflights_lock = threading.Lock()
+
+
+class Preflight(object):
+    """Loaded state of dashboards and existence of projects, resolved in bulk and kept
+
+    Loaded state of any number of dashboards costs one terms query on the
+    dashboard entry index (per PREFLIGHT_BATCH_SIZE dashboards), and project
+    existence one listing of the project roles, whose RoleManager can then
+    be used to add dashboards to projects
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.roles = get_role_manager(host, port)
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def get_loaded(self, dashboard_ids):
+        """{dashboard ID: whether it has a dashboard entry}, only querying IDs not already resolved"""
+        dashboard_ids = [str(dashboard_id) for dashboard_id in dashboard_ids]
+
+        with self._lock:
+            unresolved = list(dict.fromkeys(dashboard_id for dashboard_id in dashboard_ids
+                                            if dashboard_id not in self._loaded))
+
+        if len(unresolved) > 0:
+            loaded = self._query_loaded(unresolved)
+            with self._lock:
+                self._loaded.update(loaded)
+
+        with self._lock:
+            return {dashboard_id: self._loaded[dashboard_id] for dashboard_id in dashboard_ids}
+
+    def is_loaded(self, dashboard_id):
+        return self.get_loaded([dashboard_id])[str(dashboard_id)]
+
+    def set_loaded(self, dashboard_id, loaded=True):
+        with self._lock:
+            self._loaded[str(dashboard_id)] = loaded
+
+    def get_missing_projects(self, projects):
+        return [project for project in dict.fromkeys(projects)
+                if not self.roles.is_project_exist(project)]
+
+    def check_load(self, dashboard_ids, projects, reload=False):
+        """Assert that the projects exist and, unless reloading, that none of the dashboards are loaded"""
+        if not reload:
+            loaded = [dashboard_id for dashboard_id, is_loaded in self.get_loaded(dashboard_ids).items()
+                      if is_loaded]
+            assert len(
+                loaded) == 0, f'Dashboards already loaded: {loaded}. To reload, add --reload to command'
+
+        missing_projects = self.get_missing_projects(projects)
+        assert len(
+            missing_projects) == 0, f'Projects do not exist: {missing_projects} '
+
+    def _query_loaded(self, dashboard_ids):
+        es = initialize_es(self.host, self.port)
+        loaded = {dashboard_id: False for dashboard_id in dashboard_ids}
+
+        for idx in range(0, len(dashboard_ids), PREFLIGHT_BATCH_SIZE):
+            batch = dashboard_ids[idx:idx + PREFLIGHT_BATCH_SIZE]
+            try:
+                result = es.search(index=constants.DASHBOARD_ENTRY_INDEX, body={
+                    "size": len(batch),
+                    "_source": ["dashboard_id"],
+                    "query": {
+                        "terms": {
+                            "dashboard_id": batch
+                        }
+                    }
+                })
+            except NotFoundError:
+                # no dashboard has been loaded into this cluster yet
+                return loaded
+
+            for hit in result["hits"]["hits"]:
+                loaded[str(hit["_source"]["dashboard_id"])] = True
+
+        logger.debug(
+            f'Preflight: {sum(loaded.values())} of {len(dashboard_ids)} dashboards loaded')
+        return loaded
+
+
+def get_preflight(host, port):
+    """Preflight shared by every command and batch in this process for a cluster"""
+    key = (host, port)
+    with _preflights_lock:
+        if key not in _preflights:
+            _preflights[key] = Preflight(host, port)
+        return _preflights[key]
@@ -0,0 +1,130 @@
+import threading
+
+import alhena.constants as constants
+
+import logging
+logger = logging.getLogger('alhena_loading')
+
+
+ROLE_SUFFIX = "_dashboardReader"
+
+
+def get_role_name(project):
+    return f"{project}{ROLE_SUFFIX}"
+
+
+class RoleManager(object):
+    """Project reader roles, fetched once and changed in memory
+
+    Dashboards are added to and removed from projects without any requests,
+    flush then writes each role that changed once. With dry_run, flush only
+    logs the changes
+    """
+
+    def __init__(self, es, dry_run=False):
+        self.es = es
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self._roles = None
+        self._saved = {}
+
+    def _get_roles(self):
+        if self._roles is None:
+            response = self.es.security.get_role()
+            self._roles = {role_name: list(role["indices"][0]["names"]) if len(role["indices"]) > 0 else []
+                           for role_name, role in response.items() if role_name.endswith(ROLE_SUFFIX)}
+            self._saved = {role_name: list(names)
+                           for role_name, names in self._roles.items()}
+        return self._roles
+
+    def get_projects(self):
+        with self._lock:
+            return [role_name[:-len(ROLE_SUFFIX)] for role_name in self._get_roles()]
+
+    def is_project_exist(self, project):
+        with self._lock:
+            return get_role_name(project) in self._get_roles()
+
+    def add_project(self, project, dashboards=[]):
+        with self._lock:
+            roles = self._get_roles()
+            assert get_role_name(project) not in roles, f'Project with name {project} already exists'
+            roles[get_role_name(project)] = [
+                constants.DASHBOARD_ENTRY_INDEX] + list(dashboards)
+
+    def add_dashboard(self, dashboard_id, projects):
+        with self._lock:
+            roles = self._get_roles()
+            for project in projects:
+                role_name = get_role_name(project)
+                assert role_name in roles, f'Project {project} does not exist'
+
+                if dashboard_id not in roles[role_name]:
+                    roles[role_name].append(dashboard_id)
+
+    def remove_dashboard(self, dashboard_id, projects=[]):
+        """Remove the dashboard from the given projects, or from every project if none are given"""
+        with self._lock:
+            roles = self._get_roles()
+            role_names = [get_role_name(project) for project in projects] if len(
+                projects) > 0 else list(roles.keys())
+
+            for role_name in role_names:
+                if role_name in roles and dashboard_id in roles[role_name]:
+                    roles[role_name].remove(dashboard_id)
+
+    def get_changes(self):
+        """{role name: (names added, names removed)} of roles changed since they were fetched or last written"""
+        with self._lock:
+            if self._roles is None:
+                return {}
+
+            changes = {}
+            for role_name, names in self._roles.items():
+                saved = self._saved.get(role_name)
+                if saved is None:
+                    changes[role_name] = (list(names), [])
+                elif names != saved:
+                    changes[role_name] = ([name for name in names if name not in saved],
+                                          [name for name in saved if name not in names])
+            return changes
+
+    def format_changes(self, changes=None):
+        changes = self.get_changes() if changes is None else changes
+
+        lines = []
+        for role_name in sorted(changes):
+            added, removed = changes[role_name]
+            lines.append(role_name + ("" if role_name in self._saved else " (new)"))
+            lines += [f"  + {name}" for name in added]
+            lines += [f"  - {name}" for name in removed]
+        return "\n".join(lines)
+
+    def flush(self):
+        """Write every changed role once, returning the changes"""
+        changes = self.get_changes()
+        if len(changes) == 0:
+            return changes
+
+        if self.dry_run:
+            logger.info(
+                f'Dry run, not writing {len(changes)} roles:\n{self.format_changes(changes)}')
+            return changes
+
+        logger.info(
+            f'Writing {len(changes)} roles:\n{self.format_changes(changes)}')
+        for role_name in changes:
+            with self._lock:
+                names = list(self._roles[role_name])
+
+            self.es.security.put_role(name=role_name, body={
+                'indices': [{
+                    'names': names,
+                    'privileges': ["read"]
+                }]
+            })
+
+            with self._lock:
+                self._saved[role_name] = names
+
+        return changes
@@ -0,0 +1,113 @@
+import json
+import math
+import numpy as np
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# missing values are dropped from documents instead of being sent as null
+MISSING_MARKER = b":null"
+
+
+def _default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Unable to serialize {obj!r} ({type(obj)})")
+
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+    def _encode(data):
+        return orjson.dumps(data, default=_default, option=ORJSON_OPTIONS)
+
+    def _decode(data):
+        return orjson.loads(data)
+else:
+    class _NumpyEncoder(json.JSONEncoder):
+        def default(self, obj):
+            try:
+                return _default(obj)
+            except TypeError:
+                return super().default(obj)
+
+    _encoder = _NumpyEncoder(separators=(",", ":"), ensure_ascii=False, allow_nan=False)
+
+    def _encode(data):
+        try:
+            encoded = _encoder.encode(data)
+        except ValueError:
+            # NaN or infinity somewhere, written as null like orjson does
+            encoded = _encoder.encode(_replace_non_finite(data))
+        return encoded.encode("utf-8", "surrogatepass")
+
+    def _replace_non_finite(data):
+        if isinstance(data, dict):
+            return {key: _replace_non_finite(value) for key, value in data.items()}
+        if isinstance(data, (list, tuple)):
+            return [_replace_non_finite(value) for value in data]
+        if isinstance(data, np.ndarray):
+            return _replace_non_finite(data.tolist())
+        if isinstance(data, (float, np.floating)) and not math.isfinite(data):
+            return None
+        return data
+
+    def _decode(data):
+        return json.loads(data)
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, (float, np.floating)) and value != value)
+
+
+def dumps_bytes(data):
+    """JSON bytes of data, NaN and infinity written as null"""
+    return _encode(data)
+
+
+def dumps_document(data):
+    """JSON bytes of a document to index, leaving out top level fields that are None or NaN
+
+    Records rarely have missing values (generate_records already leaves them
+    out), so the encoded bytes are checked for them rather than every record
+    being walked before encoding
+    """
+    encoded = _encode(data)
+
+    if isinstance(data, dict) and MISSING_MARKER in encoded:
+        cleaned = {field: value for field, value in data.items()
+                   if not _is_missing(value)}
+        if len(cleaned) < len(data):
+            encoded = _encode(cleaned)
+
+    return encoded
+
+
+def bulk_lines(action, document):
+    """Action and document lines of a bulk request, newline terminated"""
+    return dumps_bytes(action) + b"\n" + dumps_document(document) + b"\n"
+
+
+class BulkSerializer(JSONSerializer):
+    """Elasticsearch client serializer using orjson when it is installed
+
+    Handles numpy values and passes already encoded bodies (such as bulk
+    request bytes) through unchanged. Nulls are kept, as request bodies like
+    index settings use them to reset values
+    """
+
+    def dumps(self, data):
+        if isinstance(data, (str, bytes)):
+            return data
+        return dumps_bytes(data).decode("utf-8")
+
+    def loads(self, s):
+        return _decode(s)
@@ -9,10 +9,20 @@ import scipy.stats
 import pandas as pd
 import numpy as np
 import alhena.constants as constants
+from alhena.cache import get_cached_data, get_directory_key
+from alhena.instrumentation import timed_stage
 from scgenome.loaders.qc import load_qc_data
 
 
 def get_colossus_tantalus_data(directory):
+    with timed_stage("parse", directory) as stage:
+        data = get_cached_data(get_directory_key(directory), directory,
+                               lambda: read_colossus_tantalus_data(directory))
+        stage["rows"] = sum(table.shape[0] for table in data.values())
+    return data
+
+
+def read_colossus_tantalus_data(directory):
     hmmcopy_data = collections.defaultdict(list)
 
     for table_name, data in load_qc_data(directory).items():
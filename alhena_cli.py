@@ -2,31 +2,112 @@ import click
 import logging
 import logging.handlers
 import os
+import time
 
 import alhena.alhena_loader
 
 # Not sure why youre doing imports this way...
-from alhena.alhena_loader import load_analysis as _load_analysis, load_merged_analysis as _load_merged_analysis
+from alhena.alhena_loader import load_analysis as _load_analysis, load_merged_analysis as _load_merged_analysis, export_analysis as _export_analysis, export_merged_analysis as _export_merged_analysis
+from alhena.export import replay_bulk as _replay_bulk, read_export_manifest as _read_export_manifest
 from alhena.alhena_data import download_analysis as _download_analysis, download_libraries_for_merged as _download_libraries_for_merged
-from alhena.elasticsearch import clean_analysis as _clean_analysis, is_loaded as _is_loaded, is_project_exist as _is_project_exist, initialize_indices as _initialize_es_indices, add_project as _add_project, get_projects as _get_projects, add_dashboard_to_projects as _add_dashboard_to_projects
+from alhena.elasticsearch import configure_es as _configure_es, clean_analysis as _clean_analysis, initialize_indices as _initialize_es_indices, add_project as _add_project, get_projects as _get_projects, add_dashboard_to_projects as _add_dashboard_to_projects, get_role_manager as _get_role_manager
 
 from alhena.isabl import get_scgenome_isabl_data as _get_scgenome_isabl_data, get_scgenome_isabl_annotation_pk as _get_scgenome_isabl_annotation_pk, get_isabl_analysis_object as _get_isabl_analysis_object
 from alhena.tantalus_colossus import get_colossus_tantalus_data as _get_colossus_tantalus_data, get_colossus_tantalus_analysis_object as _get_colossus_tantalus_analysis_object
+from alhena.cache import configure_cache as _configure_cache, get_cache_entries as _get_cache_entries, purge_cache as _purge_cache, is_cache_enabled as _is_cache_enabled
+from alhena.instrumentation import configure_instrumentation as _configure_instrumentation, write_reports as _write_reports
+from alhena.preflight import get_preflight as _get_preflight
+from alhena.pipeline import configure_pipeline as _configure_pipeline
+from alhena.async_elasticsearch import is_async_available as _is_async_available
+from alhena.batch import read_manifest as _read_manifest, load_batch as _load_batch, format_summary as _format_summary
 
 import alhena.constants as constants
 
 LOGGING_FORMAT = "%(asctime)s - %(levelname)s - %(funcName)s - %(message)s"
 
 
+def load_options(command):
+    """Options shared by every command that loads data"""
+    options = [
+        click.option('--concurrent', is_flag=True,
+                     help="Load all index types at the same time"),
+        click.option('--fast-ingest', is_flag=True,
+                     help="Disable refresh and replicas while loading, restore them afterwards"),
+        click.option('--force-merge', is_flag=True,
+                     help="With --fast-ingest, force merge each index once loaded"),
+        click.option('--resume', is_flag=True,
+                     help="Skip batches completed by a previous, interrupted load of this dashboard"),
+        click.option('--delta', is_flag=True,
+                     help="Only send cells that changed since the dashboard was last loaded"),
+        click.option('--bins-layout', type=click.Choice(constants.BINS_LAYOUTS), default=constants.BINS_LAYOUT_BIN,
+                     help="Index bins one document per bin, or packed into one document per cell and chromosome"),
+        click.option('--engine', type=click.Choice(constants.ENGINES), default=constants.ENGINE_SYNC, callback=check_engine,
+                     help="Load with the sync client and threads, or the async client overlapping every request"),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def check_engine(ctx, param, value):
+    if value == constants.ENGINE_ASYNC and not _is_async_available():
+        raise click.BadParameter(
+            "the async engine needs the async Elasticsearch client, install elasticsearch[async]")
+    return value
+
+
+def merged_options(command):
+    """Options for commands that can load merged dashboards"""
+    options = [
+        click.option('--parse-workers', default=1,
+                     help="Libraries of a merged dashboard parsed in parallel"),
+        click.option('--parse-memory', type=float, default=None,
+                     help="GB of parsed libraries to keep in memory, defaults to half the available memory"),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def get_merged_kwargs(load_kwargs):
+    """Split merged-only options off the load options"""
+    parse_memory = load_kwargs.pop('parse_memory', None)
+    return {
+        'parse_workers': load_kwargs.pop('parse_workers', 1),
+        'parse_memory': int(parse_memory * 1024 ** 3) if parse_memory is not None else None
+    }
+
+
 @click.group()
 @click.option('--host', default='localhost', help='Hostname for Elasticsearch server')
 @click.option('--port', default=9200, help='Port for Elasticsearch server')
 @click.option('--debug', is_flag=True, help='Turn on debugging logs')
+@click.option('--pool-size', default=10, help='Connections kept open to the Elasticsearch server')
+@click.option('--keep-alive/--no-keep-alive', default=True, help='Keep connections to Elasticsearch open between requests')
+@click.option('--max-inflight-bulk', type=int, default=None, help='Maximum bulk requests in flight across all indices, 8 by default')
+@click.option('--cache-dir', default=None, help='Directory for cached parsed tables. Defaults to $ALHENA_CACHE_DIR or ~/.cache/alhena')
+@click.option('--cache-size', type=float, default=None, help='Maximum size of the parsed table cache in GB, 0 to disable')
+@click.option('--report', default=None, help='Write a JSON report of per stage and index timings to this file')
+@click.option('--prometheus-textfile', default=None, help='Write the report as Prometheus metrics to this file')
+@click.option('--slice-rows', type=int, default=None, help='Rows per item passed between the stages of a load, 10000 by default')
+@click.option('--pipeline-queue-size', type=int, default=None, help='Items waiting in front of each stage of a load, 4 by default')
+@click.option('--build-workers', type=int, default=None, help='Threads turning rows into records, 2 by default')
+@click.option('--serialize-workers', type=int, default=None, help='Threads encoding records into bulk lines, 2 by default')
 @click.pass_context
-def main(ctx, host, port, debug):
+def main(ctx, host, port, debug, pool_size, keep_alive, max_inflight_bulk, cache_dir, cache_size, report, prometheus_textfile, slice_rows, pipeline_queue_size, build_workers, serialize_workers):
     ctx.obj['host'] = host
     ctx.obj['port'] = port
 
+    _configure_es(pool_size=pool_size, keep_alive=keep_alive,
+                  max_inflight_bulk=max_inflight_bulk)
+    _configure_cache(directory=cache_dir, max_gb=cache_size)
+    _configure_pipeline(slice_rows=slice_rows, queue_size=pipeline_queue_size, build_workers=build_workers,
+                        serialize_workers=serialize_workers)
+    _configure_instrumentation(
+        report=report, prometheus_textfile=prometheus_textfile)
+    ctx.call_on_close(lambda: _write_reports(
+        command=ctx.invoked_subcommand))
+
     level = logging.DEBUG if debug else logging.INFO
 
     os.makedirs('logs/', exist_ok=True)
@@ -49,26 +130,18 @@ def main(ctx, host, port, debug):
 @click.option('--id', help="ID of dashboard", required=True)
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load dashboard into")
 @click.option('--reload', is_flag=True, help="Force reload this dashboard")
-def load_analysis(ctx, data_directory, id, projects, reload):
+@load_options
+def load_analysis(ctx, data_directory, id, projects, reload, **load_kwargs):
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
 
-    assert reload or not _is_loaded(
-        id, es_host, es_port), f'Dashboard with ID {id} already loaded. To reload, add --reload to command'
-
-    nonexistant_projects = [project for project in projects if not _is_project_exist(
-        project, es_host, es_port)]
-
-    assert len(
-        nonexistant_projects) == 0, f'Projects do not exist: {nonexistant_projects} '
-
-    if reload:
-        _clean_analysis(id, host=es_host, port=es_port)
+    _get_preflight(es_host, es_port).check_load(
+        [id], projects, reload=reload or load_kwargs["delta"])
 
-    hmmcopy_data = _get_scgenome_colossus_tantalus_data(data_directory)
-    analysis_record = _get_colossus_tantalus_analysis_object(data_directory, dashboard_id)
+    hmmcopy_data = _get_colossus_tantalus_data(data_directory)
+    analysis_record = _get_colossus_tantalus_analysis_object(data_directory, id)
 
-    _load_analysis(id,hmmcopy_data,analysis_record, projects, data_directory, es_host, es_port)
+    _load_analysis(id,hmmcopy_data,analysis_record, projects, data_directory, es_host, es_port, **load_kwargs)
 
 
 @main.command()
@@ -79,25 +152,17 @@ def load_analysis(ctx, data_directory, id, projects, reload):
 @click.option('--id', help="ID of dashboard", required=True)
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load dashboard into")
 @click.option('--reload', is_flag=True, help="Force reload this dashboard")
-def load_analysis_from_dirs(ctx, alignment_dir, hmmcopy_dir, annotation_dir, id, projects, reload):
+@load_options
+def load_analysis_from_dirs(ctx, alignment_dir, hmmcopy_dir, annotation_dir, id, projects, reload, **load_kwargs):
     #is this for msk? for isabl or tantalus, i guess it was igo aka isabl
     #andrew's function, going to keep it here for when he sends over one-off data sets
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
       
-    assert reload or not _is_loaded(
-        id, es_host, es_port), f'Dashboard with ID {id} already loaded. To reload, add --reload to command'
-
-    nonexistant_projects = [project for project in projects if not _is_project_exist(
-        project, es_host, es_port)]
-
-    assert len(
-        nonexistant_projects) == 0, f'Projects do not exist: {nonexistant_projects} '
-
-    if reload:
-        _clean_analysis(id, host=es_host, port=es_port)
+    _get_preflight(es_host, es_port).check_load(
+        [id], projects, reload=reload or load_kwargs["delta"])
     
-    alhena.alhena_loader.load_analysis_from_dirs(id, projects, es_host, es_port, alignment_dir, hmmcopy_dir, annotation_dir)
+    alhena.alhena_loader.load_analysis_from_dirs(id, projects, es_host, es_port, alignment_dir, hmmcopy_dir, annotation_dir, **load_kwargs)
 
 
 @main.command()
@@ -106,24 +171,18 @@ def load_analysis_from_dirs(ctx, alignment_dir, hmmcopy_dir, annotation_dir, id,
 @click.option('--id', help="ID of dashboard", required=True)
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load dashboard into")
 @click.option('--reload', is_flag=True, help="Force reload this dashboard")
-def load_merged_analysis(ctx, data_directory, id, projects, reload):
+@load_options
+@merged_options
+def load_merged_analysis(ctx, data_directory, id, projects, reload, **load_kwargs):
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
+    merged_kwargs = get_merged_kwargs(load_kwargs)
 
-    assert reload or not _is_loaded(
-        id, es_host, es_port), f'Dashboard with ID {id} already loaded. To reload, add --reload to command'
-
-    nonexistant_projects = [project for project in projects if not _is_project_exist(
-        project, es_host, es_port)]
-
-    assert len(
-        nonexistant_projects) == 0, f'Projects do not exist: {nonexistant_projects} '
-
-    if reload:
-        _clean_analysis(id, host=es_host, port=es_port)
+    _get_preflight(es_host, es_port).check_load(
+        [id], projects, reload=reload or load_kwargs["delta"])
 
     _load_merged_analysis(id, projects,
-                          data_directory, es_host, es_port)
+                          data_directory, es_host, es_port, **load_kwargs, **merged_kwargs)
 
 
 @main.command()
@@ -132,7 +191,8 @@ def load_merged_analysis(ctx, data_directory, id, projects, reload):
 @click.option('--id', help="Experiment to get target aliquot ID of dashboard", required=True)
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load dashboard into")
 @click.option('--reload', is_flag=True, help="Force reload this dashboard")
-def load_analysis_msk(ctx, id, projects, reload):
+@load_options
+def load_analysis_msk(ctx, id, projects, reload, **load_kwargs):
 
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
@@ -145,21 +205,12 @@ def load_analysis_msk(ctx, id, projects, reload):
     id = str(annotation_pk)    
 
 
-    assert reload or not _is_loaded(
-    id, es_host, es_port), f'Dashboard with ID {id} already loaded. To reload, add --reload to command'
-
-    nonexistent_projects = [project for project in projects if not _is_project_exist(
-        project, es_host, es_port)]
-
-    assert len(
-        nonexistent_projects) == 0, f'Projects do not exist: {nonexistent_projects} '
+    _get_preflight(es_host, es_port).check_load(
+        [id], projects, reload=reload or load_kwargs["delta"])
     
-    if reload:
-        _clean_analysis(id, host=es_host, port=es_port)
-
     analysis_record = _get_isabl_analysis_object(id)
 
-    _load_analysis(dashboard_id,hmmcopy_data, analysis_record, projects, host, port)
+    _load_analysis(id, hmmcopy_data, analysis_record, projects, None, es_host, es_port, **load_kwargs)
 
 @main.command()
 @click.argument('data_directory')
@@ -167,30 +218,24 @@ def load_analysis_msk(ctx, id, projects, reload):
 @click.option('--id', help="ID of dashboard", required=True)
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load dashboard into")
 @click.option('--reload', is_flag=True, help="Force reload this dashboard")
+@load_options
+@merged_options
 # part_5
-def load_merged_analysis_bccrc(ctx, data_directory, id, projects, reload):
+def load_merged_analysis_bccrc(ctx, data_directory, id, projects, reload, **load_kwargs):
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
+    merged_kwargs = get_merged_kwargs(load_kwargs)
     # get metadata.json ,sc-test.json, id.json located in the data directory
     # check to see if those libraries exist
     # oneline new function called bccrc_verify_libraries()
 
-    assert reload or not _is_loaded(
-        id, es_host, es_port), f'Dashboard with ID {id} already loaded. To reload, add --reload to command'
-
-    nonexistant_projects = [project for project in projects if not _is_project_exist(
-        project, es_host, es_port)]
-
-    assert len(
-        nonexistant_projects) == 0, f'Projects do not exist: {nonexistant_projects} '
-
-    if reload:
-        _clean_analysis(id, host=es_host, port=es_port)
+    _get_preflight(es_host, es_port).check_load(
+        [id], projects, reload=reload or load_kwargs["delta"])
 
     _download_libraries_for_merged(id, data_directory)
 
     _load_merged_analysis(id, projects,
-                          data_directory, es_host, es_port)
+                          data_directory, es_host, es_port, **load_kwargs, **merged_kwargs)
 
 
 @main.command()
@@ -200,29 +245,91 @@ def load_merged_analysis_bccrc(ctx, data_directory, id, projects, reload):
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load dashboard into")
 @click.option('--download', is_flag=True, help="Download data")
 @click.option('--reload', is_flag=True, help="Force reload this dashboard")
-def load_analysis_shah(ctx, data_directory, id, projects, download, reload):
+@load_options
+def load_analysis_shah(ctx, data_directory, id, projects, download, reload, **load_kwargs):
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
 
-    assert reload or not _is_loaded(
-        id, es_host, es_port), f'{id} already loaded. To reload, add --reload to command'
-
-    nonexistant_projects = [project for project in projects if not _is_project_exist(
-        project, es_host, es_port)]
-
-    assert len(
-        nonexistant_projects) == 0, f'Projects do not exist: {nonexistant_projects} '
+    _get_preflight(es_host, es_port).check_load(
+        [id], projects, reload=reload or load_kwargs["delta"])
 
     if download:
         data_directory = _download_analysis(
             id, data_directory)
 
-    if reload:
-        _clean_analysis(id, host=es_host, port=es_port)
+    hmmcopy_data = _get_colossus_tantalus_data(data_directory)
+    analysis_record = _get_colossus_tantalus_analysis_object(data_directory, id)
+    _load_analysis(id, hmmcopy_data, analysis_record, projects, data_directory, es_host, es_port, **load_kwargs)
 
-    hmmcopy_data = _get_scgenome_colossus_tantalus_data(data_directory)
-    analysis_record = _get_colossus_tantalus_analysis_object(directory, dashboard_id)
-    _load_analysis(id, hmmcopy_data, analysis_record, projects, data_directory, es_host, es_port)
+
+@main.command()
+@click.argument('manifest')
+@click.pass_context
+@click.option('--workers', default=4, help="Number of dashboards loaded at the same time")
+@click.option('--reload', is_flag=True, help="Force reload dashboards that are already loaded")
+@load_options
+@merged_options
+def load_batch(ctx, manifest, workers, reload, **load_kwargs):
+    es_host = ctx.obj['host']
+    es_port = ctx.obj["port"]
+    logger = ctx.obj["logger"]
+
+    entries = _read_manifest(manifest)
+    logger.info(f'==== Loading {len(entries)} dashboards from {manifest}')
+
+    merged_kwargs = get_merged_kwargs(load_kwargs)
+    results = _load_batch(entries, es_host, es_port, workers=workers, reload=reload,
+                          merged_kwargs=merged_kwargs, **load_kwargs)
+
+    logger.info(f'==== Summary\n{_format_summary(results)}')
+
+    failed = [result["id"] for result in results if result["status"] == "failed"]
+    assert len(failed) == 0, f'Dashboards failed to load: {failed}'
+
+
+@main.command()
+@click.argument('data_directory')
+@click.pass_context
+@click.option('--id', help="ID of dashboard", required=True)
+@click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects the dashboard is added to when replayed")
+@click.option('--output', '-o', required=True, help="Directory to write the bulk files to, in a subdirectory named by the ID")
+@click.option('--merged', is_flag=True, help="Export a merged dashboard")
+@click.option('--concurrent', is_flag=True, help="Export all index types at the same time")
+@click.option('--bins-layout', type=click.Choice(constants.BINS_LAYOUTS), default=constants.BINS_LAYOUT_BIN,
+              help="Index bins one document per bin, or packed into one document per cell and chromosome")
+@merged_options
+def export_bulk(ctx, data_directory, id, projects, output, merged, **load_kwargs):
+    """Write a dashboard's bulk requests to files, without a cluster"""
+    merged_kwargs = get_merged_kwargs(load_kwargs)
+
+    if merged:
+        _export_merged_analysis(id, projects, data_directory, output, **load_kwargs, **merged_kwargs)
+    else:
+        hmmcopy_data = _get_colossus_tantalus_data(data_directory)
+        analysis_record = _get_colossus_tantalus_analysis_object(data_directory, id)
+        _export_analysis(id, hmmcopy_data, analysis_record, projects, output, **load_kwargs)
+
+
+@main.command()
+@click.argument('export_directory')
+@click.pass_context
+@click.option('--workers', default=4, help="Files sent at the same time")
+@click.option('--reload', is_flag=True, help="Force reload this dashboard")
+@click.option('--resume', is_flag=True, help="Skip files completed by a previous, interrupted replay")
+@click.option('--fast-ingest', is_flag=True, help="Disable refresh and replicas while loading, restore them afterwards")
+@click.option('--force-merge', is_flag=True, help="With --fast-ingest, force merge each index once loaded")
+def replay_bulk(ctx, export_directory, workers, reload, **replay_kwargs):
+    """Load a dashboard written by export-bulk"""
+    es_host = ctx.obj['host']
+    es_port = ctx.obj["port"]
+
+    manifest = _read_export_manifest(export_directory)
+    id = manifest["dashboard_id"]
+
+    _get_preflight(es_host, es_port).check_load(
+        [id], manifest["projects"], reload=reload or replay_kwargs["resume"])
+
+    _replay_bulk(export_directory, es_host, es_port, workers=workers, **replay_kwargs)
 
 
 @main.command()
@@ -234,13 +341,8 @@ def verify_projects(ctx, projects):
 
     logger = ctx.obj["logger"]
 
-    good_projects = []
-    bad_projects = []
-    for project in projects:
-        if _is_project_exist(project, es_host, es_port):
-            good_projects.append(project)
-        else:
-            bad_projects.append(project)
+    bad_projects = _get_preflight(es_host, es_port).get_missing_projects(projects)
+    good_projects = [project for project in projects if project not in bad_projects]
 
     logger.info(f'==== Verified project names: {len(good_projects)}')
     for project in good_projects:
@@ -273,11 +375,14 @@ def all_projects(ctx):
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load dashboard into")
 @click.option('--download', is_flag=True, help="Download data")
 @click.option('--reload', is_flag=True, help="Force reload this dashboard")
-def load_dashboard(ctx, data_directory, id, projects, download, reload):
+@load_options
+@merged_options
+def load_dashboard(ctx, data_directory, id, projects, download, reload, **load_kwargs):
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
-    nonexistant_projects = [project for project in projects if not _is_project_exist(
-        project, es_host, es_port)]
+    merged_kwargs = get_merged_kwargs(load_kwargs)
+    preflight = _get_preflight(es_host, es_port)
+    nonexistant_projects = preflight.get_missing_projects(projects)
 
     assert len(
         nonexistant_projects) == 0, f'Projects do not exist: {nonexistant_projects} '
@@ -292,28 +397,97 @@ def load_dashboard(ctx, data_directory, id, projects, download, reload):
             data_directory = _download_analysis(
                 id, data_directory)
 
-    if reload:
-        _clean_analysis(id, host=es_host, port=es_port, projects=projects)
-
-    if _is_loaded(id, es_host, es_port):
+    # a reload loads a new version of the indices and switches to it once done
+    # delta loads update a loaded dashboard in place
+    if not reload and not load_kwargs["delta"] and preflight.is_loaded(id):
         _add_dashboard_to_projects(id, projects, es_host, es_port)
         
     else:
         if download_type == "merged":
             _load_merged_analysis(id, projects,
-                                  data_directory, es_host, es_port)
+                                  data_directory, es_host, es_port, **load_kwargs, **merged_kwargs)
         elif download_type == "single":
-            hmmcopy_data = _get_scgenome_colossus_tantalus_data(data_directory)
-            analysis_record = __get_colossus_tantalus_analysis_object(directory, dashboard_id)
-            _load_analysis(id, hmmcopy_data, analysis_record, projects, data_directory, es_host, es_port)
+            hmmcopy_data = _get_colossus_tantalus_data(data_directory)
+            analysis_record = _get_colossus_tantalus_analysis_object(data_directory, id)
+            _load_analysis(id, hmmcopy_data, analysis_record, projects, data_directory, es_host, es_port, **load_kwargs)
+
+
+@main.command()
+@click.pass_context
+def cache_info(ctx):
+    logger = ctx.obj["logger"]
+
+    if not _is_cache_enabled():
+        logger.info('==== Cache is disabled (needs pyarrow and a cache size above 0)')
+
+    entries = _get_cache_entries()
+    logger.info(
+        f'==== {len(entries)} cached sources, {sum(entry["bytes"] for entry in entries) / 1024 ** 3:.2f} GB')
+    for entry in entries:
+        logger.info(
+            f'{entry["key"]}  {entry["bytes"] / 1024 ** 2:10.1f} MB  last used {time.ctime(entry["last_used"])}  {entry["source"]}')
+
+
+@main.command()
+@click.argument('keys', nargs=-1)
+@click.pass_context
+def purge_cache(ctx, keys):
+    logger = ctx.obj["logger"]
+
+    if len(keys) == 0:
+        logger.info('Purging the whole cache')
+        _purge_cache()
+
+    for key in keys:
+        logger.info(f'Purging {key}')
+        _purge_cache(key)
+
+
+@ main.command()
+@ click.argument('dashboard_ids', nargs=-1, required=True)
+@ click.pass_context
+def clean_analysis(ctx, dashboard_ids):
+    es_host = ctx.obj['host']
+    es_port = ctx.obj["port"]
+
+    # roles are rewritten once for all dashboards
+    roles = _get_role_manager(es_host, es_port)
+    try:
+        for dashboard_id in dashboard_ids:
+            _clean_analysis(dashboard_id, host=es_host,
+                            port=es_port, roles=roles)
+    finally:
+        roles.flush()
 
 
 @ main.command()
-@ click.argument('dashboard_id')
 @ click.pass_context
-def clean_analysis(ctx, dashboard_id):
-    _clean_analysis(dashboard_id,
-                    host=ctx.obj['host'], port=ctx.obj['port'])
+@ click.option('--add', 'additions', type=(str, str), multiple=True, metavar='DASHBOARD PROJECT', help="Add dashboard to project, can be given more than once")
+@ click.option('--remove', 'removals', type=(str, str), multiple=True, metavar='DASHBOARD PROJECT', help="Remove dashboard from project, can be given more than once")
+@ click.option('--remove-all', 'full_removals', multiple=True, metavar='DASHBOARD', help="Remove dashboard from every project, can be given more than once")
+@ click.option('--dry-run', is_flag=True, help="Log the role changes without writing them")
+def update_projects(ctx, additions, removals, full_removals, dry_run):
+    es_host = ctx.obj['host']
+    es_port = ctx.obj["port"]
+    logger = ctx.obj["logger"]
+
+    roles = _get_role_manager(es_host, es_port, dry_run=dry_run)
+
+    nonexistant_projects = sorted(set(project for _, project in additions
+                                      if not roles.is_project_exist(project)))
+    assert len(
+        nonexistant_projects) == 0, f'Projects do not exist: {nonexistant_projects} '
+
+    for dashboard_id, project in additions:
+        roles.add_dashboard(dashboard_id, [project])
+    for dashboard_id, project in removals:
+        roles.remove_dashboard(dashboard_id, [project])
+    for dashboard_id in full_removals:
+        roles.remove_dashboard(dashboard_id)
+
+    changes = roles.flush()
+    if len(changes) == 0:
+        logger.info('==== No role changes')
 
 
 @ main.command()
@@ -330,14 +504,15 @@ def add_project(ctx, project_name, dashboards):
     es_host = ctx.obj['host']
     es_port = ctx.obj["port"]
 
-    assert not _is_project_exist(
-        project_name, es_host, es_port), f'Project with name {project_name} already exists'
+    preflight = _get_preflight(es_host, es_port)
+    assert len(preflight.get_missing_projects(
+        [project_name])) == 1, f'Project with name {project_name} already exists'
 
     if dashboards[0] == "":
         dashboards = []
 
-    unloaded_dashboards = [dashboard_id for dashboard_id in dashboards if not _is_loaded(
-        dashboard_id, es_host, es_port)]
+    unloaded_dashboards = [dashboard_id for dashboard_id, is_loaded in preflight.get_loaded(
+        dashboards).items() if not is_loaded]
 
     assert len(
         unloaded_dashboards) == 0, f'Dashboards do not exist: {unloaded_dashboards}'
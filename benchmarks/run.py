@@ -0,0 +1,130 @@
+import click
+import json
+import os
+import resource
+import time
+
+import alhena.constants as constants
+from alhena.alhena_loader import GET_DATA, DOCUMENT_ID_FIELDS, get_record_fields, generate_records, load_records, load_records_async
+from alhena.serializer import bulk_lines
+from alhena.elasticsearch import configure_es, close_es, get_mapping, get_index_name
+from alhena.async_elasticsearch import run_async, get_async_es, close_async_es, is_async_available
+
+from benchmarks.synthetic import generate_dataset
+from benchmarks.stub_es import StubElasticsearch
+
+
+def get_peak_rss_mb():
+    """Peak resident memory of the process so far. Linux reports kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_result(stage, data_type, num_cells, num_rows, num_bytes, seconds):
+    return {
+        "stage": stage,
+        "data_type": data_type,
+        "cells": num_cells,
+        "rows": num_rows,
+        "bytes": num_bytes,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(num_rows / seconds, 1) if seconds > 0 else None,
+        "mb_per_sec": round(num_bytes / 1e6 / seconds, 2) if seconds > 0 else None,
+        "peak_rss_mb": round(get_peak_rss_mb(), 1)
+    }
+
+
+async def load_records_on_loop(data, index_name, stub, mapping, id_fields):
+    await load_records_async(get_async_es(stub.host, stub.port), data, index_name, mapping=mapping, id_fields=id_fields)
+
+
+def benchmark_data_type(dataset, data_type, num_cells, stub, engine=constants.ENGINE_SYNC):
+    results = []
+    mapping = get_mapping(data_type)
+
+    # transforms can modify their input tables, so each gets its own copy
+    tables = {name: table.copy() for name, table in dataset.items()}
+    start = time.perf_counter()
+    data = GET_DATA[data_type](tables)
+    seconds = time.perf_counter() - start
+    data_bytes = int(data.memory_usage(deep=True).sum())
+    results.append(get_result("transform", data_type,
+                              num_cells, data.shape[0], data_bytes, seconds))
+
+    start = time.perf_counter()
+    fields, id_columns = get_record_fields(
+        data, data_type, mapping, DOCUMENT_ID_FIELDS[data_type])
+    records = list(generate_records(
+        data, fields, 0, data.shape[0], id_columns=id_columns))
+    seconds = time.perf_counter() - start
+    results.append(get_result("generate_records", data_type,
+                              num_cells, len(records), data_bytes, seconds))
+
+    index_name = get_index_name("benchmark", data_type)
+    num_bytes = 0
+    start = time.perf_counter()
+    for record in records:
+        action = {"_index": index_name, "_id": record.pop("_id", None)}
+        num_bytes += len(bulk_lines({"index": action}, record))
+    seconds = time.perf_counter() - start
+    results.append(get_result("serialize", data_type,
+                              num_cells, len(records), num_bytes, seconds))
+    del records
+
+    stub.reset()
+    start = time.perf_counter()
+    if engine == constants.ENGINE_ASYNC:
+        run_async(load_records_on_loop(data, index_name, stub, mapping,
+                                       DOCUMENT_ID_FIELDS[data_type]))
+    else:
+        load_records(data, index_name, stub.host, stub.port, mapping=mapping,
+                     id_fields=DOCUMENT_ID_FIELDS[data_type])
+    seconds = time.perf_counter() - start
+    assert stub.num_documents == data.shape[0], f"{data_type}: stub received {stub.num_documents} of {data.shape[0]} documents"
+    result = get_result("load_records", data_type,
+                        num_cells, stub.num_documents, stub.num_bytes, seconds)
+    result["engine"] = engine
+    results.append(result)
+
+    return results
+
+
+@click.command()
+@click.option('--cells', '-c', type=int, multiple=True, default=[100], show_default=True, help="Number of cells, can be given more than once")
+@click.option('--data-type', '-t', type=click.Choice(constants.DATA_TYPES), multiple=True, help="Data types to benchmark, all by default")
+@click.option('--bin-size', type=int, default=500000, show_default=True, help="Size of hmmcopy bins")
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--engine', type=click.Choice(constants.ENGINES), multiple=True, help="Engines load_records is timed with, sync by default")
+@click.option('--output', '-o', type=click.File('w'), default='-', help="JSON lines output, stdout by default")
+def main(cells, data_type, bin_size, seed, engine, output):
+    """Time each loading stage on synthetic DLP data against a local stand-in for Elasticsearch"""
+    data_types = list(data_type) if len(data_type) > 0 else constants.DATA_TYPES
+    engines = list(engine) if len(engine) > 0 else [constants.ENGINE_SYNC]
+    assert constants.ENGINE_ASYNC not in engines or is_async_available(
+    ), 'The async engine needs the async Elasticsearch client, install elasticsearch[async]'
+
+    os.environ.setdefault('ALHENA_ES_USER', 'benchmark')
+    os.environ.setdefault('ALHENA_ES_PASSWORD', 'benchmark')
+    configure_es(scheme='http')
+
+    with StubElasticsearch() as stub:
+        for num_cells in cells:
+            start = time.perf_counter()
+            dataset = generate_dataset(num_cells, bin_size=bin_size, seed=seed)
+            dataset_rows = sum(table.shape[0] for table in dataset.values())
+            dataset_bytes = sum(int(table.memory_usage(deep=True).sum())
+                                for table in dataset.values())
+            output.write(json.dumps(get_result("generate_dataset", None, num_cells, dataset_rows,
+                                               dataset_bytes, time.perf_counter() - start)) + "\n")
+
+            for name in data_types:
+                for engine_name in engines:
+                    for result in benchmark_data_type(dataset, name, num_cells, stub, engine=engine_name):
+                        output.write(json.dumps(result) + "\n")
+                    output.flush()
+
+    close_async_es()
+    close_es()
+
+
+if __name__ == '__main__':
+    main()
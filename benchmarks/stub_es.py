@@ -0,0 +1,96 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubElasticsearch(object):
+    """Local HTTP server answering just enough of the Elasticsearch API for
+    load_records: index creation and existence checks, and _bulk, which
+    accepts every document. Counts the documents and bytes it receives"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.num_documents = 0
+        self.num_bytes = 0
+        self.num_requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.num_documents = 0
+            self.num_bytes = 0
+            self.num_requests = 0
+
+    def _received(self, num_documents, num_bytes):
+        with self._lock:
+            self.num_documents += num_documents
+            self.num_bytes += num_bytes
+            self.num_requests += 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, body, status=200):
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(content)
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length) if length > 0 else b""
+
+            def do_HEAD(self):
+                self._respond({})
+
+            def do_GET(self):
+                self._read_body()
+                if self.path.split("?")[0] in ["", "/"]:
+                    self._respond({
+                        "version": {"number": "7.17.0", "build_flavor": "default"},
+                        "tagline": "You Know, for Search"
+                    })
+                else:
+                    self._respond({})
+
+            def do_PUT(self):
+                self._read_body()
+                self._respond({"acknowledged": True})
+
+            def do_POST(self):
+                body = self._read_body()
+                if self.path.split("?")[0].endswith("/_bulk"):
+                    num_documents = body.count(b"\n") // 2
+                    stub._received(num_documents, len(body))
+                    self._respond({
+                        "took": 0,
+                        "errors": False,
+                        "items": [{"index": {"status": 201}}] * num_documents
+                    })
+                else:
+                    self._respond({"acknowledged": True})
+
+        return Handler
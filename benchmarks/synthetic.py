@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+
+# GRCh37
+CHROMOSOME_LENGTHS = {
+    "1": 249250621, "2": 243199373, "3": 198022430, "4": 191154276,
+    "5": 180915260, "6": 171115067, "7": 159138663, "8": 146364022,
+    "9": 141213431, "10": 135534747, "11": 135006516, "12": 133851895,
+    "13": 115169878, "14": 107349540, "15": 102531392, "16": 90354753,
+    "17": 81195210, "18": 78077248, "19": 59128983, "20": 63025520,
+    "21": 48129895, "22": 51304566, "X": 155270560, "Y": 59373566
+}
+
+SAMPLE_ID = "SA000"
+LIBRARY_ID = "A00000A"
+
+
+def generate_dataset(num_cells, bin_size=500000, segments_per_chromosome=3, seed=0):
+    """Random tables shaped like a parsed DLP library, as returned by the
+    colossus/tantalus and isabl readers"""
+    rng = np.random.RandomState(seed)
+
+    cell_ids = [f"{SAMPLE_ID}-{LIBRARY_ID}-R{row:02d}-C{col:02d}"
+                for row, col in zip(np.arange(num_cells) // 72 + 1, np.arange(num_cells) % 72 + 1)]
+
+    return {
+        "annotation_metrics": generate_annotation_metrics(cell_ids, rng),
+        "hmmcopy_reads": generate_hmmcopy_reads(cell_ids, bin_size, rng),
+        "hmmcopy_segs": generate_hmmcopy_segs(cell_ids, segments_per_chromosome, rng),
+        "gc_metrics": generate_gc_metrics(cell_ids, rng)
+    }
+
+
+def generate_annotation_metrics(cell_ids, rng):
+    num_cells = len(cell_ids)
+    total_reads = rng.randint(int(1e5), int(5e6), num_cells)
+    unmapped_reads = (total_reads * rng.uniform(0, 0.1, num_cells)).astype(int)
+
+    return pd.DataFrame({
+        "cell_id": pd.Categorical(cell_ids),
+        "sample_id": pd.Categorical([SAMPLE_ID] * num_cells),
+        "library_id": pd.Categorical([LIBRARY_ID] * num_cells),
+        "total_reads": total_reads,
+        "unmapped_reads": unmapped_reads,
+        "total_mapped_reads": total_reads - unmapped_reads,
+        "is_contaminated": rng.random_sample(num_cells) < 0.05,
+        "quality": rng.random_sample(num_cells),
+        "experimental_condition": pd.Categorical(rng.choice(["A", "B", "NTC"], num_cells)),
+        "cell_call": pd.Categorical(rng.choice(["C1", "C2"], num_cells)),
+        "order": np.arange(num_cells),
+        "mean_copy": rng.uniform(1.5, 4, num_cells),
+        "state_mode": rng.randint(1, 5, num_cells),
+        "breakpoints": rng.randint(0, 200, num_cells),
+        "MSRSI_non_integerness": rng.random_sample(num_cells),
+        "mad_neutral_state": rng.random_sample(num_cells),
+        "coverage_depth": rng.random_sample(num_cells),
+        "coverage_breadth": rng.random_sample(num_cells),
+        "median_insert_size": rng.uniform(200, 400, num_cells),
+        "scaled_halfiness": np.where(rng.random_sample(num_cells) < 0.1, np.nan, rng.random_sample(num_cells))
+    })
+
+
+def get_bins(bin_size):
+    chromosomes = []
+    starts = []
+    for chromosome, length in CHROMOSOME_LENGTHS.items():
+        chromosome_starts = np.arange(1, length + 1, bin_size)
+        chromosomes.append(np.repeat(chromosome, len(chromosome_starts)))
+        starts.append(chromosome_starts)
+
+    return np.concatenate(chromosomes), np.concatenate(starts)
+
+
+def generate_hmmcopy_reads(cell_ids, bin_size, rng):
+    chromosomes, starts = get_bins(bin_size)
+    num_cells = len(cell_ids)
+    num_bins = len(starts)
+    num_rows = num_cells * num_bins
+
+    state = rng.choice(np.arange(12), num_rows, p=[0.02, 0.05, 0.6, 0.15, 0.08, 0.04,
+                                                   0.02, 0.01, 0.01, 0.01, 0.005, 0.005])
+    copy = state + rng.normal(0, 0.3, num_rows)
+    # bins hmmcopy could not call
+    unmappable = rng.random_sample(num_rows) < 0.03
+    copy[unmappable] = np.nan
+
+    return pd.DataFrame({
+        "chr": pd.Categorical(np.tile(chromosomes, num_cells), categories=list(CHROMOSOME_LENGTHS)),
+        "start": np.tile(starts, num_cells),
+        "end": np.tile(starts, num_cells) + bin_size - 1,
+        "reads": rng.poisson(200, num_rows),
+        "gc": rng.uniform(0.3, 0.6, num_rows),
+        "map": rng.uniform(0.5, 1, num_rows),
+        "cor_gc": copy * 50,
+        "copy": copy,
+        "valid": ~unmappable,
+        "ideal": ~unmappable & (rng.random_sample(num_rows) < 0.9),
+        "modal_curve": rng.uniform(0, 2, num_rows),
+        "modal_quantile": rng.random_sample(num_rows),
+        "cor_map": copy * 50,
+        "multiplier": np.full(num_rows, 2),
+        "mad_quantile": rng.random_sample(num_rows),
+        "state": state,
+        "cell_id": pd.Categorical(np.repeat(cell_ids, num_bins), categories=cell_ids),
+        "sample_id": pd.Categorical([SAMPLE_ID] * num_rows),
+        "library_id": pd.Categorical([LIBRARY_ID] * num_rows)
+    })
+
+
+def generate_hmmcopy_segs(cell_ids, segments_per_chromosome, rng):
+    chromosomes = []
+    starts = []
+    ends = []
+    for chromosome, length in CHROMOSOME_LENGTHS.items():
+        boundaries = np.linspace(1, length + 1, segments_per_chromosome + 1).astype(int)
+        chromosomes.append(np.repeat(chromosome, segments_per_chromosome))
+        starts.append(boundaries[:-1])
+        ends.append(boundaries[1:] - 1)
+
+    chromosomes = np.concatenate(chromosomes)
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+
+    num_cells = len(cell_ids)
+    num_segments = len(starts)
+    num_rows = num_cells * num_segments
+    state = rng.randint(0, 12, num_rows)
+
+    return pd.DataFrame({
+        "chr": pd.Categorical(np.tile(chromosomes, num_cells), categories=list(CHROMOSOME_LENGTHS)),
+        "start": np.tile(starts, num_cells),
+        "end": np.tile(ends, num_cells),
+        "state": state,
+        "median": state + rng.normal(0, 0.2, num_rows),
+        "multiplier": np.full(num_rows, 2),
+        "cell_id": pd.Categorical(np.repeat(cell_ids, num_segments), categories=cell_ids),
+        "sample_id": pd.Categorical([SAMPLE_ID] * num_rows),
+        "library_id": pd.Categorical([LIBRARY_ID] * num_rows)
+    })
+
+
+def generate_gc_metrics(cell_ids, rng):
+    num_cells = len(cell_ids)
+    gc_metrics = pd.DataFrame(rng.uniform(0, 2, (num_cells, 101)),
+                              columns=[str(n) for n in range(101)])
+    gc_metrics.insert(0, "cell_id", cell_ids)
+    return gc_metrics